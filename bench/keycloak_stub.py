@@ -0,0 +1,314 @@
+"""
+ベンチマーク用の Keycloak 代替サーバ（ローカル専用）。
+
+本物の Keycloak の代わりに、Realm の以下のエンドポイントだけを提供する。
+  - GET  /realms/{realm}/.well-known/openid-configuration
+  - GET  /realms/{realm}/protocol/openid-connect/certs
+  - POST /realms/{realm}/protocol/openid-connect/token   (password / refresh_token / client_credentials)
+  - POST /realms/{realm}/protocol/openid-connect/token/introspect
+
+鍵はローカルで生成した RSA(RS256 / PS256)、EC(ES256) または Ed25519(EdDSA) 鍵で、
+Keycloak と同じ形（realm_access / resource_access / scope など）のアクセストークンを発行する。
+"""
+import json
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+
+ALGORITHMS = ("RS256", "PS256", "ES256", "EdDSA")
+
+
+def generate_key(alg: str) -> Tuple[Any, Dict[str, Any]]:
+    """署名用の秘密鍵と、対応する公開鍵の JWK（kid 付き）を生成する。"""
+    kid = secrets.token_urlsafe(16)
+    if alg in ("RS256", "PS256"):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    elif alg == "ES256":
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        jwk = ECAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    elif alg == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        jwk = OKPAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    else:
+        raise ValueError(f"unsupported alg: {alg}")
+    jwk.update({"kid": kid, "alg": alg, "use": "sig"})
+    return private_key, jwk
+
+
+class KeycloakStub:
+    """
+    Keycloak の Realm を模したローカル HTTP サーバ。
+
+    Args:
+        realm (str): Realm 名
+        alg (str): 署名アルゴリズム（RS256 / PS256 / ES256 / EdDSA）
+        client_id (str): トークンを発行するクライアント ID（azp）
+        api_client_id (str): ロールを付与する API 側クライアント ID（aud / resource_access）
+        client_roles (Iterable[str]): api_client_id に対して付与するクライアントロール
+        token_lifetime (int): アクセストークンの有効期間（秒）
+    """
+
+    def __init__(
+        self,
+        realm: str = "test-realm",
+        alg: str = "RS256",
+        client_id: str = "test-client",
+        api_client_id: str = "backend-api",
+        client_roles: Iterable[str] = ("app:owner",),
+        token_lifetime: int = 300,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.realm = realm
+        self.alg = alg
+        self.client_id = client_id
+        self.api_client_id = api_client_id
+        self.client_roles = list(client_roles)
+        self.token_lifetime = token_lifetime
+
+        # (kid, 秘密鍵) の一覧。先頭が現在の署名鍵、残りはローテーション前の鍵
+        self._keys: List[Tuple[str, Any]] = []
+        self._jwks: List[Dict[str, Any]] = []
+        self._refresh_tokens: Dict[str, Tuple[str, float]] = {}
+        # 失効させたセッション（sid）。イントロスペクションで active=false になる
+        self._revoked_sessions: set = set()
+        # イントロスペクションの応答を遅らせる秒数（問い合わせの集約を確かめるため）
+        self.introspect_delay = 0.0
+        self._lock = threading.Lock()
+
+        self.certs_requests = 0
+        self.token_requests = 0
+        self.introspect_requests = 0
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.rotate_key()
+
+    # ====== URL ======
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def issuer(self) -> str:
+        return f"{self.base_url}/realms/{self.realm}"
+
+    # ====== 鍵 ======
+    @property
+    def current_kid(self) -> str:
+        return self._keys[0][0]
+
+    def rotate_key(self, keep_previous: int = 1) -> str:
+        """新しい署名鍵を作って先頭に追加し、古い鍵は keep_previous 個だけ JWKS に残す。"""
+        private_key, jwk = generate_key(self.alg)
+        with self._lock:
+            self._keys = [(jwk["kid"], private_key)] + self._keys[:keep_previous]
+            self._jwks = [jwk] + self._jwks[:keep_previous]
+        return jwk["kid"]
+
+    def jwks(self) -> Dict[str, Any]:
+        return {"keys": list(self._jwks)}
+
+    # ====== トークン発行 ======
+    def access_token_claims(
+        self,
+        username: str = "user1",
+        client_roles: Optional[Iterable[str]] = None,
+        lifetime: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Keycloak のアクセストークンと同じ形のクレームを作る。"""
+        now = int(time.time())
+        roles = self.client_roles if client_roles is None else list(client_roles)
+        return {
+            "exp": now + (self.token_lifetime if lifetime is None else lifetime),
+            "iat": now,
+            "jti": str(uuid.uuid4()),
+            "iss": self.issuer,
+            "aud": [self.api_client_id, "account"],
+            "sub": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.realm}/{username}")),
+            "typ": "Bearer",
+            "azp": self.client_id,
+            "sid": str(uuid.uuid4()),
+            "acr": "1",
+            "allowed-origins": ["http://localhost:5000"],
+            "realm_access": {
+                "roles": [f"default-roles-{self.realm}", "offline_access", "uma_authorization"],
+            },
+            "resource_access": {
+                self.api_client_id: {"roles": roles},
+                "account": {"roles": ["manage-account", "manage-account-links", "view-profile"]},
+            },
+            "scope": "openid profile email",
+            "email_verified": True,
+            "name": f"{username} test",
+            "preferred_username": username,
+            "given_name": username,
+            "family_name": "test",
+            "email": f"{username}@example.com",
+        }
+
+    def mint_access_token(self, username: str = "user1", **kwargs: Any) -> str:
+        kid, private_key = self._keys[0]
+        claims = self.access_token_claims(username, **kwargs)
+        return jwt.encode(claims, private_key, algorithm=self.alg, headers={"kid": kid})
+
+    def token_response(self, username: str) -> Dict[str, Any]:
+        refresh_token = secrets.token_urlsafe(32)
+        refresh_lifetime = self.token_lifetime * 6
+        with self._lock:
+            self._refresh_tokens[refresh_token] = (username, time.time() + refresh_lifetime)
+        return {
+            "access_token": self.mint_access_token(username),
+            "expires_in": self.token_lifetime,
+            "refresh_expires_in": refresh_lifetime,
+            "refresh_token": refresh_token,
+            "token_type": "Bearer",
+            "not-before-policy": 0,
+            "session_state": str(uuid.uuid4()),
+            "scope": "openid profile email",
+        }
+
+    def _grant(self, form: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        grant_type = form.get("grant_type")
+        if grant_type == "password":
+            if not form.get("username"):
+                return 401, {"error": "invalid_grant", "error_description": "Invalid user credentials"}
+            return 200, self.token_response(form["username"])
+        if grant_type == "client_credentials":
+            return 200, self.token_response(f"service-account-{form.get('client_id', self.client_id)}")
+        if grant_type == "refresh_token":
+            with self._lock:
+                # Keycloak のリフレッシュトークンローテーションと同様、使い捨てにする
+                entry = self._refresh_tokens.pop(form.get("refresh_token", ""), None)
+            if entry is None or entry[1] <= time.time():
+                return 400, {"error": "invalid_grant", "error_description": "Invalid refresh token"}
+            return 200, self.token_response(entry[0])
+        return 400, {"error": "unsupported_grant_type"}
+
+    # ====== 失効・イントロスペクション ======
+    def revoke(self, token: str) -> None:
+        """トークンのセッションをログアウトさせる（以後のイントロスペクションで active=false）。"""
+        claims = jwt.decode(token, options={"verify_signature": False})
+        with self._lock:
+            self._revoked_sessions.add(claims.get("sid"))
+
+    def introspect(self, token: str) -> Dict[str, Any]:
+        kids = dict(self._keys)
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid not in kids:
+                return {"active": False}
+            claims = jwt.decode(
+                token,
+                kids[kid].public_key(),
+                algorithms=[self.alg],
+                issuer=self.issuer,
+                options={"verify_aud": False},
+            )
+        except jwt.PyJWTError:
+            return {"active": False}
+        if claims.get("sid") in self._revoked_sessions:
+            return {"active": False}
+        return {**claims, "active": True, "client_id": claims.get("azp"), "username": claims.get("preferred_username")}
+
+    def discovery(self) -> Dict[str, Any]:
+        oidc = f"{self.issuer}/protocol/openid-connect"
+        return {
+            "issuer": self.issuer,
+            "authorization_endpoint": f"{oidc}/auth",
+            "token_endpoint": f"{oidc}/token",
+            "introspection_endpoint": f"{oidc}/token/introspect",
+            "userinfo_endpoint": f"{oidc}/userinfo",
+            "end_session_endpoint": f"{oidc}/logout",
+            "jwks_uri": f"{oidc}/certs",
+            "id_token_signing_alg_values_supported": [self.alg],
+        }
+
+    # ====== HTTP ======
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status_code: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                prefix = f"/realms/{stub.realm}"
+                if self.path == f"{prefix}/protocol/openid-connect/certs":
+                    stub.certs_requests += 1
+                    return self._send(200, stub.jwks())
+                if self.path == f"{prefix}/.well-known/openid-configuration":
+                    return self._send(200, stub.discovery())
+                self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode()
+                form = {k: v[0] for k, v in parse_qs(raw).items()}
+                oidc = f"/realms/{stub.realm}/protocol/openid-connect"
+                if self.path == f"{oidc}/token":
+                    stub.token_requests += 1
+                    return self._send(*stub._grant(form))
+                if self.path == f"{oidc}/token/introspect":
+                    stub.introspect_requests += 1
+                    if stub.introspect_delay:
+                        time.sleep(stub.introspect_delay)
+                    return self._send(200, stub.introspect(form.get("token", "")))
+                self._send(404, {"error": "not found"})
+
+        return Handler
+
+    def start(self) -> "KeycloakStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> "KeycloakStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Keycloak stand-in for local benchmarks")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--realm", default="test-realm")
+    parser.add_argument("--alg", default="RS256", choices=ALGORITHMS)
+    args = parser.parse_args()
+
+    stub = KeycloakStub(realm=args.realm, alg=args.alg, port=args.port)
+    print(f"Keycloak stub: {stub.issuer}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,178 @@
+"""
+認証パスのベンチマーク。
+
+KeycloakStub を起動し、その鍵で署名したトークンを使って
+src/server/app.py（uvicorn）の /protected と /authorize に並列で負荷をかけ、
+スループットと p50/p95/p99 レイテンシを出力する。
+
+シナリオ:
+  - cold:     リクエストごとに別トークン（検証キャッシュが効かない）
+  - warm:     少数のトークンを使い回す（検証キャッシュが効く）
+  - rotation: 途中で鍵をローテーションし、新しい kid のトークンを混ぜる
+
+使い方:
+  python bench/run_bench.py --requests 2000 --concurrency 16
+  python bench/run_bench.py --scenario warm --json bench_output.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src", "client"))
+
+from api_client import ApiClient, ApiError  # noqa: E402
+from keycloak_stub import ALGORITHMS, KeycloakStub  # noqa: E402
+
+SCENARIOS = ("cold", "warm", "rotation")
+ROUTES = ("/protected", "/authorize")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ApiServer:
+    """src/server/app.py を uvicorn のサブプロセスとして起動する。"""
+
+    def __init__(self, stub: KeycloakStub, workers: int = 1, env: Optional[Dict[str, str]] = None):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._env = {
+            **os.environ,
+            "KC_BASE": stub.base_url,
+            "REALM": stub.realm,
+            "API_CLIENT_ID": stub.api_client_id,
+            **(env or {}),
+        }
+        self._workers = workers
+        self._proc: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "ApiServer":
+        self._proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app:app",
+                "--host", "127.0.0.1", "--port", str(self.port),
+                "--workers", str(self._workers), "--log-level", "warning",
+            ],
+            cwd=os.path.join(ROOT, "src", "server"),
+            env=self._env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"{self.base_url}/health", timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                pass
+            if self._proc.poll() is not None:
+                raise RuntimeError("API server exited during startup")
+            time.sleep(0.1)
+        raise RuntimeError("API server did not become ready")
+
+    def __exit__(self, *exc) -> None:
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait(timeout=10)
+
+
+def drive(base_url: str, tokens: List[str], concurrency: int) -> Dict[str, Any]:
+    """tokens[i] を使って i 番目のリクエストを送り、レイテンシとエラー内訳を集計する。"""
+    api_client = ApiClient(base_url=base_url, pool_maxsize=concurrency)
+    latencies: List[float] = [0.0] * len(tokens)
+    errors: Dict[str, int] = {}
+
+    def one(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            api_client.call_api(path=ROUTES[i % len(ROUTES)], access_token=tokens[i])
+        except ApiError as e:
+            key = str(e.status_code or "network")
+            errors[key] = errors.get(key, 0) + 1
+        latencies[i] = time.perf_counter() - start
+
+    started = time.perf_counter()
+    with api_client, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(len(tokens))))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(tokens),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(tokens) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+    }
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    env = {"TOKEN_CACHE_SIZE": str(args.cache_size)}
+    with KeycloakStub(alg=args.alg) as stub, ApiServer(stub, workers=args.workers, env=env) as server:
+        if name == "cold":
+            tokens = [stub.mint_access_token(f"user{i}") for i in range(args.requests)]
+        elif name == "warm":
+            pool = [stub.mint_access_token(f"user{i}") for i in range(args.users)]
+            tokens = [pool[i % len(pool)] for i in range(args.requests)]
+        else:
+            # 前半は起動時に取得済みの鍵、後半はローテーション後の新しい kid で署名したトークン
+            half = args.requests // 2
+            old = [stub.mint_access_token(f"user{i}") for i in range(args.users)]
+            stub.rotate_key()
+            new = [stub.mint_access_token(f"user{i}") for i in range(args.users)]
+            tokens = [old[i % len(old)] for i in range(half)]
+            tokens += [new[i % len(new)] for i in range(args.requests - half)]
+
+        certs_before = stub.certs_requests
+        result = drive(server.base_url, tokens, args.concurrency)
+        result["jwks_fetches"] = stub.certs_requests - certs_before
+        return {"scenario": name, **result}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark token verification in the API server")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=8, help="distinct tokens for warm/rotation runs")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--cache-size", type=int, default=1024, help="TOKEN_CACHE_SIZE for the server")
+    parser.add_argument("--alg", choices=ALGORITHMS, default="RS256")
+    parser.add_argument("--json", dest="json_path", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    names = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = [run_scenario(name, args) for name in names]
+
+    print(f"{'scenario':<10} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'jwks':>5}  errors")
+    for r in results:
+        print(
+            f"{r['scenario']:<10} {r['throughput_rps']:>9} {r['p50_ms']:>8} "
+            f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['jwks_fetches']:>5}  {r['errors'] or '-'}"
+        )
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
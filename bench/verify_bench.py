@@ -0,0 +1,90 @@
+"""
+署名アルゴリズムごとの検証コストのマイクロベンチマーク（HTTP を介さない）。
+
+アルゴリズムごとに鍵を作ってトークンを 1 つ発行し、次の処理の 1 回あたりの所要時間を測る。
+  - jwt.decode:  ヘッダの再パースと鍵の受け渡しを毎回行う従来の方法
+  - prepared:    parse_token で 1 回だけ分解し、kid ごとに準備済みの鍵（PreparedKey）で検証
+  - parse:       prepared のうち、トークンの分解だけ
+  - signature:   prepared のうち、署名検証だけ
+
+使い方:
+  python bench/verify_bench.py
+  python bench/verify_bench.py --iterations 5000 --alg ES256 --alg EdDSA --json verify.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+
+import jwt
+from jwt import PyJWK
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src", "server"))
+
+from keycloak_stub import ALGORITHMS, KeycloakStub  # noqa: E402
+from verifier import PreparedKey, parse_token, verify_token  # noqa: E402
+
+
+def per_call_us(func: Callable[[], Any], iterations: int) -> float:
+    """func を iterations 回実行し、1 回あたりのマイクロ秒を返す（最初の 1 割はウォームアップ）。"""
+    for _ in range(max(1, iterations // 10)):
+        func()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def bench_alg(alg: str, iterations: int) -> Dict[str, Any]:
+    stub = KeycloakStub(alg=alg)
+    try:
+        token = stub.mint_access_token()
+        jwk = PyJWK.from_dict(stub.jwks()["keys"][0])
+        prepared = PreparedKey.from_jwk(jwk)
+        parsed = parse_token(token)
+        issuer = stub.issuer
+    finally:
+        stub.stop()
+
+    def legacy():
+        header = jwt.get_unverified_header(token)
+        assert header["kid"] == jwk.key_id
+        jwt.decode(token, jwk.key, algorithms=[alg], issuer=issuer, options={"verify_aud": False})
+
+    def fast():
+        verify_token(parse_token(token), prepared, issuer=issuer)
+
+    return {
+        "alg": alg,
+        "jwt_decode_us": round(per_call_us(legacy, iterations), 1),
+        "prepared_us": round(per_call_us(fast, iterations), 1),
+        "parse_us": round(per_call_us(lambda: parse_token(token), iterations), 1),
+        "signature_us": round(per_call_us(lambda: prepared.verify_signature(parsed), iterations), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare per-algorithm JWT verification cost")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--alg", action="append", choices=ALGORITHMS, help="repeatable (default: all)")
+    parser.add_argument("--json", dest="json_path", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [bench_alg(alg, args.iterations) for alg in (args.alg or ALGORITHMS)]
+
+    print(f"{'alg':<6} {'jwt.decode us':>14} {'prepared us':>12} {'parse us':>9} {'signature us':>13}")
+    for r in results:
+        print(
+            f"{r['alg']:<6} {r['jwt_decode_us']:>14} {r['prepared_us']:>12} "
+            f"{r['parse_us']:>9} {r['signature_us']:>13}"
+        )
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,132 @@
+import json
 import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
 
 API_BASE = "http://app:8000"
 TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+# コネクションプール：保持するホスト別プールの数と、1 ホストあたりの最大接続数
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+# リトライ：冪等メソッドのみ、接続エラーと一時的な 5xx に対して指数バックオフで再試行
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+RETRY_STATUSES = (502, 503, 504)
+# リクエストを端から端まで追跡するための ID ヘッダ（サーバは同じ値を返し、Server-Timing に内訳を載せる）
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+# ====== 計測（接続 / 最初のバイトまで / JSON デコード） ======
+_connect_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """新しい接続を張るのにかかった時間（TCP + TLS）を計測できる HTTPAdapter。"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """Server-Timing ヘッダ（"auth;dur=1.2, total;dur=3.4"）を {名前: ミリ秒} にする。"""
+    phases: Dict[str, float] = {}
+    for entry in (value or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, dur = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    phases[name] = phases.get(name, 0.0) + float(dur)
+                except ValueError:
+                    pass
+    return phases
+
+
+def timed_request(
+    session: requests.Session,
+    method: str,
+    url: str,
+    request_id: str,
+    **kwargs: Any
+) -> Tuple[requests.Response, Dict[str, Any]]:
+    """
+    リクエストを送り、ボディまで読み込んだレスポンスとクライアント側の計測値を返す。
+
+    計測値（ミリ秒）:
+        connect_ms:  新しい接続を張った時間（keep-alive で再利用したら 0）
+        ttfb_ms:     送信開始からレスポンスヘッダを受け取るまで（connect を含む）
+        download_ms: ボディの受信
+        server:      サーバが Server-Timing で返したフェーズごとの時間
+    JSON デコードの時間は呼び出し側で json_ms として追加する。
+    """
+    _connect_timing.seconds = 0.0
+    started = time.perf_counter()
+    response = session.request(method, url, stream=True, **kwargs)
+    headers_at = time.perf_counter()
+    response.content  # ボディを読み切って接続をプールに戻す
+    done_at = time.perf_counter()
+    timing = {
+        "request_id": response.headers.get(REQUEST_ID_HEADER, request_id),
+        "method": method,
+        "url": url,
+        "status": response.status_code,
+        "connect_ms": round(_connect_timing.seconds * 1000, 3),
+        "ttfb_ms": round((headers_at - started) * 1000, 3),
+        "download_ms": round((done_at - headers_at) * 1000, 3),
+        "server": parse_server_timing(response.headers.get("Server-Timing")),
+    }
+    return response, timing
+
+
+def decode_json(response: requests.Response, timing: Dict[str, Any]) -> Any:
+    """JSON をデコードし、かかった時間を timing["json_ms"] に記録する。"""
+    started = time.perf_counter()
+    try:
+        return json.loads(response.content)
+    finally:
+        timing["json_ms"] = round((time.perf_counter() - started) * 1000, 3)
 
 
 class ApiError(Exception):
@@ -14,49 +138,134 @@ class ApiError(Exception):
 
 
 class ApiClient:
-    def __init__(self, base_url: str = API_BASE, timeout: float = TIMEOUT):
+    """
+    保護 API を呼び出すクライアント。
+    Session を 1 つ持ち、keep-alive の接続をプールして使い回す。
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_BASE,
+        timeout: float = TIMEOUT,
+        pool_connections: int = POOL_CONNECTIONS,
+        pool_maxsize: int = POOL_MAXSIZE,
+        max_retries: int = MAX_RETRIES,
+        backoff_factor: float = RETRY_BACKOFF,
+        token_provider: Optional[Callable[[], str]] = None,
+        timing_hook: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
+        # access_token 省略時に呼ばれる（例: KeycloakClient.token_manager(...)）
+        self.token_provider = token_provider
+        # call_api のたびに計測値（timed_request を参照）を渡して呼ばれる
+        self.timing_hook = timing_hook
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # GET/PUT/DELETE など冪等メソッドのみ
+            raise_on_status=False,  # 最後のレスポンスをそのまま返し、ApiError に変換させる
+        )
+        adapter = TimedHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self) -> None:
+        """プール中の接続をすべて閉じる。"""
+        self.session.close()
+
+    def __enter__(self) -> "ApiClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _auth_headers(self, access_token: Optional[str], headers: Optional[dict]) -> dict:
+        if access_token is None and self.token_provider is not None:
+            access_token = self.token_provider()
+        if not access_token:
+            raise ValueError("Access token is required")
+        headers = dict(headers or {})
+        headers["Authorization"] = f"Bearer {access_token}"
+        headers.setdefault(REQUEST_ID_HEADER, new_request_id())
+        return headers
+
+    def stream(
+        self,
+        path: str,
+        access_token: Optional[str] = None,
+        method: str = "GET",
+        **kwargs
+    ) -> requests.Response:
+        """
+        レスポンスボディを読み込まずに返す（リバースプロキシ用）。
+        ステータスコードに関わらず例外にしないので、呼び出し側で確認し、読み終えたら close() すること。
+        """
+        headers = self._auth_headers(access_token, kwargs.pop("headers", None))
+        try:
+            return self.session.request(
+                method,
+                self.base_url + path,
+                headers=headers,
+                timeout=self.timeout,
+                stream=True,
+                **kwargs
+            )
+        except requests.RequestException as e:
+            raise ApiError(f"Network error during API call: {e}") from e
 
     def call_api(
         self,
         path: str,
-        access_token: str,
+        access_token: Optional[str] = None,
         method: str = "GET",
         **kwargs
     ) -> dict:
         """
         汎用的なAPI呼び出しメソッド
+        access_token を省略した場合は token_provider から取得する。
         """
-        if not access_token:
-            raise ValueError("Access token is required")
-
         url = self.base_url + path
-        headers = kwargs.pop("headers", {})
-        headers["Authorization"] = f"Bearer {access_token}"
+        headers = self._auth_headers(access_token, kwargs.pop("headers", None))
 
         try:
-            response = requests.request(
+            response, timing = timed_request(
+                self.session,
                 method,
                 url,
+                headers[REQUEST_ID_HEADER],
                 headers=headers,
                 timeout=self.timeout,
                 **kwargs
             )
-            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ApiError(f"Network error during API call: {e}") from e
+
+        try:
+            if response.status_code >= 400:
+                try:
+                    details = response.json()
+                except (ValueError, TypeError):
+                    details = response.text
+                raise ApiError(
+                    f"API call failed with status {response.status_code}",
+                    status_code=response.status_code,
+                    details=details
+                )
             # No Contentの場合は空のdictを返す
             if response.status_code == 204:
                 return {}
-            return response.json()
-        except requests.HTTPError as e:
             try:
-                details = e.response.json()
-            except (ValueError, TypeError):
-                details = e.response.text
-            raise ApiError(
-                f"API call failed with status {e.response.status_code}",
-                status_code=e.response.status_code,
-                details=details
-            ) from e
-        except requests.RequestException as e:
-            raise ApiError(f"Network error during API call: {e}") from e
+                return decode_json(response, timing)
+            except ValueError as e:
+                raise ApiError(f"Invalid JSON in API response: {e}", status_code=response.status_code) from e
+        finally:
+            if self.timing_hook is not None:
+                self.timing_hook(timing)
@@ -0,0 +1,126 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import httpx
+
+from api_client import API_BASE, POOL_MAXSIZE, TIMEOUT, ApiError
+
+# call_many の同時実行数の既定値
+CONCURRENCY = POOL_MAXSIZE
+
+
+class AsyncApiClient:
+    """
+    ApiClient の asyncio 版。
+    1 つの httpx.AsyncClient（コネクションプール）を共有し、複数 API を並行に呼び出せる。
+    失敗時は ApiClient と同じく ApiError を投げる。
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_BASE,
+        timeout: float = TIMEOUT,
+        max_connections: int = POOL_MAXSIZE,
+        concurrency: int = CONCURRENCY,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def aclose(self) -> None:
+        """プール中の接続をすべて閉じる。"""
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "AsyncApiClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def call_api(
+        self,
+        path: str,
+        access_token: str,
+        method: str = "GET",
+        **kwargs
+    ) -> dict:
+        """
+        汎用的なAPI呼び出しメソッド（非同期版）
+        """
+        if not access_token:
+            raise ValueError("Access token is required")
+
+        url = self.base_url + path
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["Authorization"] = f"Bearer {access_token}"
+
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        except httpx.RequestError as e:
+            raise ApiError(f"Network error during API call: {e}") from e
+
+        if response.is_error:
+            try:
+                details = response.json()
+            except ValueError:
+                details = response.text
+            raise ApiError(
+                f"API call failed with status {response.status_code}",
+                status_code=response.status_code,
+                details=details,
+            )
+        # No Contentの場合は空のdictを返す
+        if response.status_code == 204:
+            return {}
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ApiError(f"Invalid JSON in API response: {e}", status_code=response.status_code) from e
+
+    async def call_many(
+        self,
+        calls: Iterable[Dict[str, Any]],
+        access_token: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Union[dict, ApiError]]:
+        """
+        複数の API 呼び出しを並行に実行する。
+
+        Args:
+            calls (Iterable[dict]): call_api の引数（path, method, json など）の一覧。
+                個別に access_token を指定することもできる
+            access_token (str, optional): calls 側で指定がない場合に使うアクセストークン
+            concurrency (int, optional): 同時実行数の上限（既定は self.concurrency）
+            timeout (float, optional): 1 呼び出しあたりのタイムアウト秒（既定は self.timeout）
+
+        Returns:
+            list: calls と同じ順序の結果。成功ならレスポンス dict、失敗なら ApiError
+                （アクセストークンが無いなど、どんな失敗でもその呼び出しの結果として返し、他の呼び出しは止めない）
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        per_call_timeout = self.timeout if timeout is None else timeout
+
+        async def run(call: Dict[str, Any]) -> Union[dict, ApiError]:
+            kwargs = dict(call)
+            kwargs.setdefault("access_token", access_token)
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self.call_api(**kwargs), per_call_timeout)
+                except asyncio.TimeoutError:
+                    return ApiError(f"API call timed out after {per_call_timeout}s")
+                except ApiError as e:
+                    return e
+                except Exception as e:
+                    error = ApiError(f"API call failed: {e}")
+                    error.__cause__ = e
+                    return error
+
+        return await asyncio.gather(*(run(call) for call in calls))
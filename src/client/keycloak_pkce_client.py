@@ -2,14 +2,16 @@ import base64
 import hashlib
 import os
 import secrets
+import threading
 import time
-from typing import Any, Dict
-from urllib.parse import urlencode
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode, urlsplit
 
 import requests
-from flask import Flask, abort, jsonify, redirect, request, session
+from flask import Flask, Response, abort, jsonify, redirect, request, session, stream_with_context
 from jwt import decode as jwt_decode
 from api_client import ApiClient, ApiError
+from session_store import MemorySessionStore, ServerSideSessionInterface, SqliteSessionStore
 
 # ===== 設定 =====
 KC_BASE = os.environ["KC_BASE"]
@@ -18,12 +20,42 @@ CLIENT_ID = os.environ["CLIENT_ID"]
 REDIRECT_URI = os.environ["REDIRECT_URI"]
 SESSION_SECRET = "dev-only-change-me"
 SCOPES = "openid profile email"
+# セッションの保存先: memory（単一プロセス）/ sqlite（複数ワーカー）/ cookie（Flask 標準の署名付き Cookie）
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.sqlite3")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+# 同じセッションのリフレッシュ完了を待つ最大秒数と、成功した結果を使い回す秒数
+REFRESH_WAIT_TIMEOUT = float(os.getenv("REFRESH_WAIT_TIMEOUT", "10"))
+REFRESH_RESULT_TTL = float(os.getenv("REFRESH_RESULT_TTL", "30"))
+# アクセストークンの期限の何秒前から更新するか
+REFRESH_LEEWAY = int(os.getenv("REFRESH_LEEWAY", "30"))
+# API へのプロキシでレスポンスを中継するときの読み込み単位（バイト）
+PROXY_CHUNK_SIZE = int(os.getenv("PROXY_CHUNK_SIZE", "65536"))
+# セッション Cookie の SameSite 属性（Lax / Strict）
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "Lax")
+# 状態を変えるプロキシ呼び出しを許す Origin（未指定なら REDIRECT_URI のオリジン）
+FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "")
+# Origin / Referer が無いリクエストに要求するヘッダ（クロスサイトの form 送信では付けられない）
+CSRF_HEADER = os.getenv("CSRF_HEADER", "X-Requested-With")
 
 AUTH_URL = f"{KC_BASE}/realms/{REALM}/protocol/openid-connect/auth"
 TOKEN_URL = f"{KC_BASE}/realms/{REALM}/protocol/openid-connect/token"
 
 app = Flask(__name__)
-app.config.update(SECRET_KEY=SESSION_SECRET)
+app.config.update(SECRET_KEY=SESSION_SECRET, SESSION_COOKIE_SAMESITE=SESSION_COOKIE_SAMESITE)
+
+# トークンはサーバ側に置き、Cookie には不透明なセッション ID だけを載せる
+if SESSION_BACKEND == "memory":
+    app.session_interface = ServerSideSessionInterface(
+        MemorySessionStore(max_entries=SESSION_MAX_ENTRIES), ttl=SESSION_TTL
+    )
+elif SESSION_BACKEND == "sqlite":
+    app.session_interface = ServerSideSessionInterface(
+        SqliteSessionStore(SESSION_DB_PATH), ttl=SESSION_TTL
+    )
+elif SESSION_BACKEND != "cookie":
+    raise ValueError(f"unknown SESSION_BACKEND: {SESSION_BACKEND}")
 
 api_client = ApiClient()
 
@@ -48,30 +80,73 @@ def decode_jwt_unverified(token: str) -> Dict[str, Any]:
         return {}
 
 
-def is_access_token_expiring_soon(access_token: str, leeway_seconds: int = 30) -> bool:
+def access_token_expiry(token_response: Dict[str, Any]) -> Optional[float]:
+    """
+    トークンレスポンスからアクセストークンの期限（UNIX 時刻）を求める。
+    JWT の exp を優先し、読めなければ expires_in から計算する。
+    """
+    exp = decode_jwt_unverified(token_response.get("access_token") or "").get("exp")
+    if isinstance(exp, (int, float)):
+        return exp
+    expires_in = token_response.get("expires_in")
+    if isinstance(expires_in, (int, float)):
+        return time.time() + expires_in
+    return None
+
+
+def session_tokens(token_response: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    セッションに保存するトークン一式を作る。
+    期限は保存時に 1 回だけ求めておき、リクエストごとに JWT をデコードしないようにする。
+    （refresh_token / id_token は返らないこともあるので、その場合は以前の値を引き継ぐ）
+    """
+    previous = previous or {}
+    return {
+        "access_token": token_response.get("access_token"),
+        "refresh_token": token_response.get("refresh_token", previous.get("refresh_token")),
+        "id_token": token_response.get("id_token", previous.get("id_token")),
+        "expires_at": access_token_expiry(token_response),
+    }
+
+
+def is_access_token_expiring_soon(
+    access_token: str,
+    leeway_seconds: int = 30,
+    expires_at: Optional[float] = None,
+) -> bool:
     """
     access_token の exp を読み、現在時刻 + leeway を過ぎていたら True。
+    expires_at（保存済みの期限）が渡されればデコードせずにそれを使う。
     exp が取れない/不正なら「安全側」で True を返す。
     """
-    claims = decode_jwt_unverified(access_token)
-    exp = claims.get("exp")
+    exp = expires_at
+    if exp is None:
+        exp = decode_jwt_unverified(access_token).get("exp")
     if not isinstance(exp, (int, float)):
         return True
     now = int(time.time())
     return exp <= now + leeway_seconds
 
 
-def refresh_tokens() -> Dict[str, Any]:
-    """
-    セッション内の refresh_token を使ってトークン更新。
-    成功すればセッションの tokens を更新して返す。
-    失敗時は 401 を投げる（ログアウト扱いにしたい場合はセッションをクリアしてもよい）。
-    """
-    tokens = session.get("tokens") or {}
-    refresh_token = tokens.get("refresh_token")
-    if not refresh_token:
-        abort(401, "no refresh_token in session")
+class _RefreshFlight:
+    """1 つの refresh_token に対する更新処理。完了を待つ Event と結果を持つ。"""
+
+    __slots__ = ("event", "result", "error", "done_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+        self.done_at: Optional[float] = None
+
+
+# refresh_token のダイジェスト -> 実行中/直近に完了した更新処理
+_refresh_flights: Dict[bytes, _RefreshFlight] = {}
+_refresh_flights_lock = threading.Lock()
+
 
+def _post_refresh(refresh_token: str) -> Dict[str, Any]:
+    """トークンエンドポイントへ refresh_token グラントを送る。失敗時は abort する。"""
     data = {
         "grant_type": "refresh_token",
         "client_id": CLIENT_ID,
@@ -85,32 +160,187 @@ def refresh_tokens() -> Dict[str, Any]:
     if tr.status_code != 200:
         # 典型: invalid_grant（期限切れ/取り消し）
         abort(401, f"token refresh failed: {tr.text}")
+    return tr.json()
+
+
+def _refresh_once(refresh_token: str) -> Dict[str, Any]:
+    """
+    同じ refresh_token での更新を 1 回にまとめる（single-flight）。
+
+    最初のリクエストだけがトークンエンドポイントを呼び、並行する他のリクエストは
+    REFRESH_WAIT_TIMEOUT 秒まで結果を待つ。成功した結果は REFRESH_RESULT_TTL 秒間保持し、
+    古いセッション内容を読んだ後続リクエストにも同じ結果を返す
+    （リフレッシュトークンのローテーションで負けたリクエストが 401 にならないように）。
+    """
+    key = hashlib.sha256(refresh_token.encode()).digest()
+    now = time.monotonic()
+    with _refresh_flights_lock:
+        for k in [k for k, f in _refresh_flights.items()
+                  if f.done_at is not None and now - f.done_at > REFRESH_RESULT_TTL]:
+            del _refresh_flights[k]
+        flight = _refresh_flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _refresh_flights[key] = _RefreshFlight()
+
+    if leader:
+        try:
+            flight.result = _post_refresh(refresh_token)
+            flight.done_at = time.monotonic()
+        except Exception as e:
+            # 失敗（Keycloak の一時的な 502/504 など）は待っているリクエストにだけ返し、保持しない。
+            # 次のリクエストは改めてトークンエンドポイントを呼ぶ
+            flight.error = e
+            with _refresh_flights_lock:
+                if _refresh_flights.get(key) is flight:
+                    del _refresh_flights[key]
+        finally:
+            flight.event.set()
+    elif not flight.event.wait(REFRESH_WAIT_TIMEOUT):
+        abort(504, "token refresh timed out")
+
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+
+def refresh_tokens() -> Dict[str, Any]:
+    """
+    セッション内の refresh_token を使ってトークン更新。
+    成功すればセッションの tokens を更新して返す。
+    失敗時は 401 を投げる（ログアウト扱いにしたい場合はセッションをクリアしてもよい）。
+    同じセッションからの並行リクエストでは、トークンエンドポイントへの送信は 1 回だけになる。
+    """
+    tokens = session.get("tokens") or {}
+    refresh_token = tokens.get("refresh_token")
+    if not refresh_token:
+        abort(401, "no refresh_token in session")
 
-    new_tokens = tr.json()
     # 必要なフィールドのみを上書き（id_token は返らないこともある）
-    session["tokens"] = {
-        "access_token": new_tokens.get("access_token"),
-        "refresh_token": new_tokens.get("refresh_token", refresh_token),
-        "id_token": new_tokens.get("id_token", tokens.get("id_token")),
-    }
+    session["tokens"] = session_tokens(_refresh_once(refresh_token), previous=tokens)
     return session["tokens"]
 
 
+def fresh_tokens() -> Dict[str, Any]:
+    """セッションのトークンを返す。アクセストークンの期限が近ければ先に更新する。"""
+    tokens = session.get("tokens") or {}
+    access_token = tokens.get("access_token")
+    if access_token and is_access_token_expiring_soon(
+        access_token, leeway_seconds=REFRESH_LEEWAY, expires_at=tokens.get("expires_at")
+    ):
+        tokens = refresh_tokens()
+    return tokens
+
+
+# ===== API へのプロキシ =====
+# 接続ごとのヘッダ（中継しない）
+_HOP_BY_HOP_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+})
+# ブラウザから API へは送らないヘッダ（セッション Cookie は API に渡さず、Authorization は差し替える）
+_DROP_REQUEST_HEADERS = _HOP_BY_HOP_HEADERS | {"host", "cookie", "authorization", "content-length"}
+# API からブラウザへは返さないヘッダ（API の Set-Cookie でフロントの session Cookie を上書きさせない）
+_DROP_RESPONSE_HEADERS = _HOP_BY_HOP_HEADERS | {"set-cookie"}
+# CSRF チェックが不要なメソッド
+_SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def _origin_of(url: str) -> Optional[str]:
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+_ALLOWED_ORIGIN = _origin_of(FRONTEND_ORIGIN or REDIRECT_URI)
+
+
+def _csrf_ok() -> bool:
+    """
+    状態を変えるメソッドが同じオリジンから来たかを確認する。
+
+    - Origin（無ければ Referer）があれば、フロントのオリジンと一致するときだけ通す
+    - どちらも無ければ CSRF_HEADER が付いているときだけ通す
+    """
+    if request.method in _SAFE_METHODS:
+        return True
+    origin = request.headers.get("Origin")
+    if origin is None and request.referrer:
+        origin = _origin_of(request.referrer)
+    if origin is not None:
+        return origin.lower() == _ALLOWED_ORIGIN
+    return bool(request.headers.get(CSRF_HEADER))
+
+
+def _session_access_token():
+    """
+    セッションのアクセストークンを返す（期限が近ければ先に更新する）。
+
+    Returns:
+        tuple: (アクセストークン, None) または (None, エラーレスポンス)
+    """
+    if not session.get("user"):
+        return None, (jsonify({"error": "unauthenticated"}), 401)
+    try:
+        tokens = fresh_tokens()
+    except Exception as e:
+        return None, (jsonify({"error": "token refresh failed", "details": str(e)}), 401)
+    access_token = tokens.get("access_token")
+    if not access_token:
+        return None, (jsonify({"error": "no access token"}), 401)
+    return access_token, None
+
+
+def proxy_to_api(path: str):
+    """
+    セッションのアクセストークンを付けて API にリクエストを中継する。
+    ApiClient のコネクションプール（keep-alive）を使い、レスポンスはバッファせずにそのまま流す。
+    """
+    if not _csrf_ok():
+        return jsonify({"error": "cross-site request rejected"}), 403
+    access_token, error = _session_access_token()
+    if error is not None:
+        return error
+
+    if request.query_string:
+        path = f"{path}?{request.query_string.decode('latin-1')}"
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _DROP_REQUEST_HEADERS}
+    try:
+        upstream = api_client.stream(
+            path,
+            access_token=access_token,
+            method=request.method,
+            headers=headers,
+            data=request.get_data() or None,
+        )
+    except ApiError as e:
+        return jsonify({"error": "API call failed", "details": str(e)}), 502
+
+    def body():
+        try:
+            # 圧縮されたままのバイト列を流す（Content-Encoding / Content-Length もそのまま中継）
+            yield from upstream.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+        finally:
+            upstream.close()
+
+    response_headers = [
+        (k, v) for k, v in upstream.raw.headers.items() if k.lower() not in _DROP_RESPONSE_HEADERS
+    ]
+    return Response(stream_with_context(body()), status=upstream.status_code, headers=response_headers)
+
+
 # ===== ルーティング =====
 @app.route("/")
 def root():
     user = session.get("user")
     if user:
-        tokens = session.get("tokens")
-        access_token = tokens.get("access_token")
-
         # アクセストークンの期限が近ければ自動更新
-        if access_token and is_access_token_expiring_soon(access_token, leeway_seconds=30):
-            try:
-                tokens = refresh_tokens()
-            except Exception as e:
-                # リフレッシュ失敗時は未認証扱い（必要なら session.clear() してもよい）
-                return jsonify({"message": "token refresh failed", "error": str(e)}), 401
+        try:
+            fresh_tokens()
+        except Exception as e:
+            # リフレッシュ失敗時は未認証扱い（必要なら session.clear() してもよい）
+            return jsonify({"message": "token refresh failed", "error": str(e)}), 401
 
         tokens = session.get("tokens", {})
         return jsonify(
@@ -192,57 +422,27 @@ def callback():
         "preferred_username": claims.get("preferred_username"),
         "email": claims.get("email"),
     }
-    session["tokens"] = {
-        "access_token": tokens.get("access_token"),
-        "refresh_token": tokens.get("refresh_token"),
-        "id_token": tokens.get("id_token"),
-    }
+    session["tokens"] = session_tokens(tokens)
 
     return redirect("/")
 
 
 @app.route("/protected")
 def protected():
-    # 1) セッションにユーザーがいなければ未認証
-    user = session.get("user")
-    if not user:
-        return jsonify({"error": "unauthenticated"}), 401
-
-    # 2) アクセストークン必須（期限切れ等はAPI側で検出される想定）
-    tokens = session.get("tokens") or {}
-    access_token = tokens.get("access_token")
-    if not access_token:
-        return jsonify({"error": "no access token"}), 401
-
-    # 3) 認証のみを確認するAPI(/protected)を呼ぶ
-    try:
-        response = api_client.call_api(path="/protected", access_token=access_token)
-        print("[green]Protected API call successful![/green]")
-        return response
-    except ApiError as e:
-        return jsonify({"error": "API call failed", "details": e.details}), e.status_code or 500
+    # 認証のみを確認するAPI(/protected)を呼ぶ
+    return proxy_to_api("/protected")
 
 
 @app.route("/authorize")
 def authorize():
-    # 1) セッションにユーザーがいなければ未認証
-    user = session.get("user")
-    if not user:
-        return jsonify({"error": "unauthenticated"}), 401
+    # 認可を確認するAPI(/authorize)を呼ぶ
+    return proxy_to_api("/authorize")
 
-    # 2) アクセストークン必須（期限切れ等はAPI側で検出される想定）
-    tokens = session.get("tokens")
-    access_token = tokens.get("access_token")
-    if not access_token:
-        return jsonify({"error": "no access token"}), 401
 
-    # 3) 認可を確認するAPI(/authorize)を呼ぶ
-    try:
-        response = api_client.call_api(path="/authorize", access_token=access_token)
-        print("[green]API call successful![/green]")
-        return response
-    except ApiError as e:
-        return jsonify({"error": "API call failed", "details": e.details}), e.status_code or 500
+@app.route("/api/<path:path>", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE"])
+def api_proxy(path):
+    """/api/<path> を API の /<path> に中継する。"""
+    return proxy_to_api(f"/{path}")
 
 
 if __name__ == "__main__":
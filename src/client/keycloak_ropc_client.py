@@ -1,10 +1,27 @@
+import argparse
+import asyncio
+import json
 import os
 import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from rich import print
 
-from api_client import ApiClient, ApiError
+from api_client import (
+    API_BASE,
+    REQUEST_ID_HEADER,
+    TIMEOUT,
+    ApiClient,
+    ApiError,
+    TimedHTTPAdapter,
+    decode_json,
+    new_request_id,
+    timed_request,
+)
 
 
 class TokenAcquisitionError(Exception):
@@ -20,7 +37,7 @@ class KeycloakClient:
     Keycloak とやり取りしてアクセストークンやリフレッシュトークンを取得・更新するクライアント。
     """
 
-    def __init__(self, base_url, realm, client_id, client_secret=None):
+    def __init__(self, base_url, realm, client_id, client_secret=None, timeout=TIMEOUT, timing_hook=None):
         """
         Keycloak クライアントを初期化する。
 
@@ -29,14 +46,26 @@ class KeycloakClient:
             realm (str): Keycloak の Realm 名
             client_id (str): クライアント ID
             client_secret (str, optional): クライアントシークレット（Confidential Client の場合は必須）
+            timeout (float, optional): トークンエンドポイントへのリクエストタイムアウト（秒）
+            timing_hook (callable, optional): トークンリクエストごとに計測値（dict）を渡して呼ばれる
         """
         self.base_url = base_url.rstrip("/")
         self.realm = realm
         self.client_id = client_id
         self.client_secret = client_secret
+        self.timeout = timeout
         self.token_url = (
             f"{self.base_url}/realms/{self.realm}/protocol/openid-connect/token"
         )
+        # トークンエンドポイントへの接続を keep-alive で使い回す
+        self.session = requests.Session()
+        self.session.mount("http://", TimedHTTPAdapter())
+        self.session.mount("https://", TimedHTTPAdapter())
+        self.timing_hook = timing_hook
+
+    def close(self):
+        """トークンエンドポイントへの接続を閉じる。"""
+        self.session.close()
 
     def _post_token(self, payload):
         """
@@ -51,10 +80,27 @@ class KeycloakClient:
         Raises:
             TokenAcquisitionError: 通信エラーや認証エラーが発生した場合
         """
+        request_id = new_request_id()
+        timing = None
         try:
-            r = requests.post(self.token_url, data=payload)
+            r, timing = timed_request(
+                self.session,
+                "POST",
+                self.token_url,
+                request_id,
+                data=payload,
+                headers={REQUEST_ID_HEADER: request_id},
+                timeout=self.timeout,
+            )
             r.raise_for_status()
-            return r.json()
+            try:
+                return decode_json(r, timing)
+            except ValueError as e:
+                # 2xx でも JSON 以外（プロキシのエラーページなど）が返った場合
+                raise TokenAcquisitionError(
+                    "トークンエンドポイントの応答が JSON ではありません",
+                    details={"raw_response": r.text[:1000], "error": str(e)},
+                ) from e
         except requests.exceptions.HTTPError as e:
             try:
                 error_details = e.response.json()
@@ -66,6 +112,9 @@ class KeycloakClient:
             ) from e
         except requests.RequestException as e:
             raise TokenAcquisitionError("トークンリクエスト中にネットワークエラーが発生しました", details=str(e)) from e
+        finally:
+            if timing is not None and self.timing_hook is not None:
+                self.timing_hook(timing)
 
     def get_token_with_password(self, username, password):
         """
@@ -107,72 +156,432 @@ class KeycloakClient:
 
         return self._post_token(payload)
 
+    def token_manager(self, username, password, **kwargs):
+        """
+        このクライアントを使ってトークンを自動管理する TokenManager を作る。
+
+        Args:
+            username (str): ユーザー名
+            password (str): パスワード
+            **kwargs: TokenManager に渡す追加オプション
+
+        Returns:
+            TokenManager: トークンをキャッシュ・自動更新するマネージャ
+        """
+        return TokenManager(self, username, password, **kwargs)
+
+
+class TokenManager:
+    """
+    現在のトークンセットをキャッシュし、期限前に自動更新するスレッドセーフなトークン供給元。
+
+    - get_access_token() は有効なアクセストークンを返す（期限が近ければその場で更新）
+    - 複数スレッドが同時に更新しようとしても、トークンエンドポイントへのリクエストは 1 回にまとめる
+    - リフレッシュトークンが失効していればパスワードグラントで取り直す
+    - start() するとバックグラウンドスレッドが expires_in の少し前に更新する
+    - インスタンス自体を呼び出すとアクセストークンを返すので、ApiClient の token_provider に渡せる
+    """
+
+    def __init__(self, kc_client, username, password, leeway_seconds=30):
+        """
+        Args:
+            kc_client (KeycloakClient): トークン取得に使うクライアント
+            username (str): ユーザー名
+            password (str): パスワード
+            leeway_seconds (float, optional): 期限の何秒前に更新するか
+        """
+        self.kc_client = kc_client
+        self.username = username
+        self.password = password
+        self.leeway_seconds = leeway_seconds
+
+        self._lock = threading.Lock()
+        self._token_data = None
+        self._refresh_at = 0.0
+        self._expires_at = 0.0
+        self._refresh_expires_at = 0.0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def _store(self, token_data):
+        now = time.monotonic()
+        expires_in = float(token_data.get("expires_in") or 0)
+        refresh_expires_in = token_data.get("refresh_expires_in")
+        self._token_data = token_data
+        self._expires_at = now + expires_in
+        # 寿命が短いトークンでも半分は使ってから更新する
+        self._refresh_at = self._expires_at - min(self.leeway_seconds, expires_in / 2)
+        if not token_data.get("refresh_token"):
+            self._refresh_expires_at = 0.0
+        elif refresh_expires_in:
+            self._refresh_expires_at = now + float(refresh_expires_in)
+        else:
+            # Keycloak は 0 をオフライントークン（期限なし）の意味で返す
+            self._refresh_expires_at = float("inf")
+
+    def _fetch(self):
+        """リフレッシュトークンが使えればそれで、ダメならパスワードグラントで取得する。"""
+        if self._token_data and time.monotonic() < self._refresh_expires_at:
+            try:
+                return self.kc_client.get_token_with_refresh_token(
+                    self._token_data["refresh_token"]
+                )
+            except TokenAcquisitionError:
+                # 失効・取り消し済み（invalid_grant）ならパスワードグラントに切り替える
+                pass
+        return self.kc_client.get_token_with_password(self.username, self.password)
+
+    def refresh(self, force=False):
+        """
+        トークンを更新する。ロック待ちの間に別スレッドが更新済みなら何もしない。
+
+        Args:
+            force (bool, optional): まだ有効でも必ず更新する
+
+        Returns:
+            dict: 現在のトークンレスポンス
+        """
+        observed = self._token_data
+        with self._lock:
+            if self._token_data is not observed and self._token_data is not None:
+                return self._token_data
+            if not force and self._token_data and time.monotonic() < self._refresh_at:
+                return self._token_data
+            try:
+                self._store(self._fetch())
+            except TokenAcquisitionError as e:
+                self.last_error = e
+                # まだ期限内なら、更新に失敗しても今のトークンを使い続ける
+                if self._token_data and time.monotonic() < self._expires_at:
+                    return self._token_data
+                raise
+            self.last_error = None
+            return self._token_data
+
+    def get_token(self):
+        """有効なトークンレスポンス（access_token, refresh_token などを含む dict）を返す。"""
+        token_data = self._token_data
+        if token_data is not None and time.monotonic() < self._refresh_at:
+            return token_data
+        return self.refresh()
+
+    def get_access_token(self):
+        return self.get_token()["access_token"]
+
+    def __call__(self):
+        return self.get_access_token()
+
+    # ====== バックグラウンド更新 ======
+    def _run(self):
+        while True:
+            if self.last_error is not None:
+                # 失敗直後は少し間を空けて再試行する
+                delay = 5.0
+            else:
+                delay = max(self._refresh_at - time.monotonic(), 0.0)
+            if self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+            except TokenAcquisitionError:
+                # last_error に記録済み。次の get_access_token() で呼び出し元に例外が伝わる
+                pass
+            except Exception as e:
+                # 想定外の例外でも更新スレッドは止めず、last_error に残して 5 秒後に再試行する
+                self.last_error = e
+
+    def start(self):
+        """最初のトークンを取得し、バックグラウンド更新スレッドを開始する。"""
+        self.get_token()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.kc_client.timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ====== 負荷生成（python keycloak_ropc_client.py で実行） ======
+class LoadStats:
+    """操作（API パスやトークン取得）ごとのレイテンシとエラー件数を集計する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, op, seconds):
+        with self._lock:
+            self.latencies[op].append(seconds)
+
+    def error(self, op, key):
+        with self._lock:
+            self.errors[op][key] += 1
+
+    def report(self, elapsed, config):
+        """スループット・ステータスコード別エラー・パーセンタイルをまとめた dict を返す。"""
+        ops = {}
+        total_ok = total_errors = 0
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(op, ()))
+            errors = dict(self.errors.get(op, {}))
+            ops[op] = {
+                "ok": len(values),
+                "errors": errors,
+                "latency_ms": {
+                    "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+                    **{f"p{p}": round(_percentile(values, p) * 1000, 3) for p in (50, 90, 95, 99)},
+                    "max": round(values[-1] * 1000, 3) if values else 0.0,
+                },
+            }
+            if not op.startswith("token:"):
+                total_ok += len(values)
+                total_errors += sum(errors.values())
+        return {
+            "config": config,
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": total_ok + total_errors,
+            "errors": total_errors,
+            "throughput_rps": round((total_ok + total_errors) / elapsed, 1) if elapsed > 0 else 0.0,
+            "operations": ops,
+        }
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _error_key(e):
+    """エラー集計のキー。HTTP ステータスがあればその番号、無ければ network。"""
+    status_code = getattr(e, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(e.__cause__, "response", None), "status_code", None)
+    return str(status_code) if status_code is not None else "network"
+
+
+class _Schedule:
+    """
+    目標レートに沿って i 番目のリクエストの送信予定時刻を払い出す（rate=0 なら待たずに送る）。
+    total か deadline に達したら None を返す。
+    """
+
+    def __init__(self, rate, total, duration):
+        self.rate = rate
+        self.total = total
+        self.start = time.monotonic()
+        self.deadline = self.start + duration if duration else float("inf")
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            i = self._next
+            self._next += 1
+        if self.total and i >= self.total:
+            return None
+        at = self.start + i / self.rate if self.rate else time.monotonic()
+        if at >= self.deadline:
+            return None
+        return i, at
+
+
+class _UserSlot:
+    __slots__ = ("username", "password", "token_data")
+
+    def __init__(self, username, password, token_data=None):
+        self.username = username
+        self.password = password
+        self.token_data = token_data
+
+
+def acquire_tokens(kc_client, credentials, concurrency, stats):
+    """ユーザーごとにパスワードグラントでトークンを並行取得する（失敗したユーザーは除外）。"""
+
+    def acquire(cred):
+        started = time.perf_counter()
+        try:
+            token_data = kc_client.get_token_with_password(*cred)
+        except TokenAcquisitionError as e:
+            stats.error("token:password", _error_key(e))
+            return None
+        stats.record("token:password", time.perf_counter() - started)
+        return _UserSlot(cred[0], cred[1], token_data)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return [slot for slot in pool.map(acquire, credentials) if slot is not None]
+
+
+def _refresh_loop(kc_client, slots, interval, stop, stats):
+    """interval 秒ごとに全ユーザーのトークンをリフレッシュトークンで更新する。"""
+    while not stop.wait(interval):
+        for slot in slots:
+            if stop.is_set():
+                return
+            refresh_token = slot.token_data.get("refresh_token")
+            if not refresh_token:
+                continue
+            started = time.perf_counter()
+            try:
+                slot.token_data = kc_client.get_token_with_refresh_token(refresh_token)
+            except TokenAcquisitionError as e:
+                stats.error("token:refresh", _error_key(e))
+                continue
+            stats.record("token:refresh", time.perf_counter() - started)
+
+
+def run_threads(api_client, slots, paths, schedule, concurrency, stats):
+    """スレッドで API に負荷をかける（ApiClient のコネクションプールを共有）。"""
+
+    def worker():
+        while True:
+            job = schedule.next()
+            if job is None:
+                return
+            i, at = job
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            path = paths[i % len(paths)]
+            token = slots[i % len(slots)].token_data["access_token"]
+            started = time.perf_counter()
+            try:
+                api_client.call_api(path=path, access_token=token)
+            except ApiError as e:
+                stats.error(path, _error_key(e))
+                continue
+            stats.record(path, time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+async def run_asyncio(base_url, slots, paths, schedule, concurrency, stats, timeout=TIMEOUT):
+    """asyncio タスクで API に負荷をかける（AsyncApiClient のコネクションプールを共有）。"""
+    from async_api_client import AsyncApiClient
+
+    async with AsyncApiClient(base_url, timeout=timeout, max_connections=concurrency) as client:
+
+        async def worker():
+            while True:
+                job = schedule.next()
+                if job is None:
+                    return
+                i, at = job
+                delay = at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                path = paths[i % len(paths)]
+                token = slots[i % len(slots)].token_data["access_token"]
+                started = time.perf_counter()
+                try:
+                    await client.call_api(path, access_token=token)
+                except ApiError as e:
+                    stats.error(path, _error_key(e))
+                    continue
+                stats.record(path, time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Keycloak と保護 API に負荷をかけ、結果を JSON で出力する",
+        epilog="環境変数: KC_BASE, REALM, CLIENT_ID, (CLIENT_SECRET), USERNAME, PASSWORD。"
+        "USERNAME に {i} を含めると user{i} のように 1..--users の別ユーザーになる",
+    )
+    parser.add_argument("--api-base", default=os.getenv("API_BASE", API_BASE))
+    parser.add_argument("--users", type=int, default=1, help="トークンを取得するユーザー（セッション）数")
+    parser.add_argument("--mode", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--concurrency", type=int, default=8, help="スレッド数 / タスク数")
+    parser.add_argument("--rate", type=float, default=0, help="目標リクエスト数/秒（0 なら上限なし）")
+    parser.add_argument("--duration", type=float, default=10, help="実行秒数（0 なら --requests まで）")
+    parser.add_argument("--requests", type=int, default=0, help="総リクエスト数（0 なら --duration まで）")
+    parser.add_argument("--paths", default="/protected,/authorize", help="順番に呼び出すパス（カンマ区切り）")
+    parser.add_argument("--refresh-interval", type=float, default=30, help="リフレッシュ間隔（秒。0 で無効）")
+    parser.add_argument("--output", help="レポートの出力先ファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error("--duration と --requests の少なくとも一方を指定してください")
+
+    username = os.environ["USERNAME"]
+    password = os.environ["PASSWORD"]
+    credentials = [
+        (username.format(i=i) if "{i}" in username else username, password)
+        for i in range(1, args.users + 1)
+    ]
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
 
-if __name__ == "__main__":
-    # --- 使用例 ---
     kc_client = KeycloakClient(
         base_url=os.environ["KC_BASE"],
         realm=os.environ["REALM"],
         client_id=os.environ["CLIENT_ID"],
-        # client_secret=os.environ["CLIENT_SECRET"],
+        client_secret=os.getenv("CLIENT_SECRET"),
     )
-    api_client = ApiClient()
-
+    stats = LoadStats()
+    stop = threading.Event()
     try:
-        # 1) ユーザー名とパスワードでトークン取得
-        token_data = kc_client.get_token_with_password(
-            os.environ["USERNAME"], os.environ["PASSWORD"]
-        )
-        print("[bold green]アクセストークンを取得しました:[/]")
-        access_token = token_data.get("access_token")
-        # print(f"access_token: {access_token}")
+        # 1) ユーザーごとにパスワードグラントでトークンを取得
+        slots = acquire_tokens(kc_client, credentials, args.concurrency, stats)
+        if not slots:
+            print("[red]トークンを 1 件も取得できませんでした[/]", file=sys.stderr)
+            json.dump(stats.report(0, vars(args)), sys.stderr, indent=2)
+            return 1
 
-        # 2) APIの呼び出し
-        try:
-            print("Calling protected API...")
-            response = api_client.call_api(path="/protected", access_token=access_token)
-            print("[green]API call successful![/green]")
-            # print(response)
-        except ApiError as e:
-            print(f"[bold red][API ERROR] {e}[/bold red]", file=sys.stderr)
-            if getattr(e, "details", None):
-                print(f"details: {e.details}", file=sys.stderr)
-
-        # 3) リフレッシュトークンで更新
-        refresh_token = token_data.get("refresh_token")
-        if not refresh_token:
-            print("[yellow]レスポンスに refresh_token が含まれていません。"
-                  "クライアント/Realm 側でリフレッシュトークン発行を許可してください。[/]")
+        # 2) 定期的にリフレッシュトークンで更新しつつ
+        refresher = None
+        if args.refresh_interval > 0:
+            refresher = threading.Thread(
+                target=_refresh_loop,
+                args=(kc_client, slots, args.refresh_interval, stop, stats),
+                daemon=True,
+            )
+            refresher.start()
+
+        # 3) API に負荷をかける
+        print(
+            f"[green]{len(slots)} users, {args.mode} x{args.concurrency}, "
+            f"rate={args.rate or 'max'}/s → {args.api_base}[/]",
+            file=sys.stderr,
+        )
+        schedule = _Schedule(args.rate, args.requests, args.duration)
+        if args.mode == "threads":
+            with ApiClient(args.api_base, pool_maxsize=args.concurrency) as api_client:
+                run_threads(api_client, slots, paths, schedule, args.concurrency, stats)
         else:
-            refreshed = kc_client.get_token_with_refresh_token(refresh_token)
-            print("[bold green]リフレッシュトークンで更新しました:[/]")
-            # print(refreshed)
+            asyncio.run(run_asyncio(args.api_base, slots, paths, schedule, args.concurrency, stats))
+        elapsed = time.monotonic() - schedule.start
+    finally:
+        stop.set()
+        kc_client.close()
 
-        # 4) APIの呼び出し
-        access_token = refreshed.get("access_token")
-        # 4.1) /protected
-        try:
-            print("Calling protected API...")
-            response = api_client.call_api(path="/protected", access_token=access_token)
-            print("[green]API call successful![/green]")
-            # print(response)
-        except ApiError as e:
-            print(f"[bold red][API ERROR] {e}[/bold red]", file=sys.stderr)
-            if getattr(e, "details", None):
-                print(f"details: {e.details}", file=sys.stderr)
-
-        # 4.2) /authorize
-        try:
-            print("Calling protected API...")
-            response = api_client.call_api(path="/authorize", access_token=access_token)
-            print("[green]API call successful![/green]")
-            # print(response)
-        except ApiError as e:
-            print(f"[bold red][API ERROR] {e}[/bold red]", file=sys.stderr)
-            if getattr(e, "details", None):
-                print(f"details: {e.details}", file=sys.stderr)
-    
-    except TokenAcquisitionError as e:
-        print(f"[red]エラー:[/] {e}")
-        if e.details:
-            print(f"詳細: {e.details}")
+    report = stats.report(elapsed, {**vars(args), "users": len(slots)})
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
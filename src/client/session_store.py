@@ -0,0 +1,170 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    """
+    単一プロセス向けのインメモリセッションストア（LRU + TTL）。
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            # 呼び出し側での変更がストアに漏れないようコピーを返す
+            return dict(data)
+
+    def save(self, sid: str, data: Dict[str, Any], ttl: float) -> None:
+        with self._lock:
+            self._entries[sid] = (time.time() + ttl, dict(data))
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SqliteSessionStore:
+    """
+    複数ワーカー（同一ホスト）向けの SQLite ファイルを使ったセッションストア。
+    接続はスレッドごとに持ち、WAL モードで読み書きの競合を減らす。
+    """
+
+    # save() を何回呼んだら期限切れ行をまとめて掃除するか
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str = "sessions.sqlite3"):
+        self.path = path
+        self._local = threading.local()
+        self._saves = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at > ?",
+            (sid, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid: str, data: Dict[str, Any], ttl: float) -> None:
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+            (sid, json.dumps(data, separators=(",", ":")), now + ttl),
+        )
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        conn.commit()
+
+    def delete(self, sid: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        conn.commit()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """セッション ID とデータを持つ Flask セッション。変更の有無を追跡する。"""
+
+    def __init__(self, initial: Optional[Dict[str, Any]] = None, sid: Optional[str] = None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+        self.regenerate = False
+
+    def clear(self) -> None:
+        # ログイン時の session.clear() で ID も振り直す（セッション固定化対策）
+        super().clear()
+        self.regenerate = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    セッションの中身をサーバ側ストアに置き、Cookie には不透明なセッション ID だけを載せる。
+
+    Args:
+        store: load / save / delete を持つストア（MemorySessionStore / SqliteSessionStore）
+        ttl (float): 最後に保存してからセッションを保持する秒数
+    """
+
+    def __init__(self, store, ttl: float = 3600):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request) -> ServerSideSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=None)
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid and (session.modified or session.regenerate):
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        if session.sid and session.regenerate:
+            self.store.delete(session.sid)
+            session.sid = None
+        if not session.sid:
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, dict(session), self.ttl)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            max_age=int(self.ttl),
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
@@ -1,11 +1,44 @@
+import hmac
+import logging
 import os
-from typing import Dict, Any
+import time
+from contextlib import asynccontextmanager
+import asyncio
+from typing import Iterable, List, Optional, Tuple
 
-import jwt
-from jwt import PyJWKClient, InvalidTokenError
-from fastapi import FastAPI, Depends, HTTPException, status
+from jwt import (
+    ExpiredSignatureError,
+    ImmatureSignatureError,
+    InvalidAlgorithmError,
+    InvalidIssuerError,
+    InvalidSignatureError,
+    InvalidTokenError,
+)
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from pydantic import BaseModel, ValidationError
+
+from audit import AuditLog, JsonlFileSink
+from crypto_pool import CryptoPool
+from ext_authz import PathRules, batch_result, bearer_token, identity_headers, original_path
+from introspection import (
+    IntrospectionUnavailableError,
+    TokenInactiveError,
+    TokenIntrospector,
+    token_age,
+)
+from policies import RolePolicy, RoleSet
+from principal import Principal
+from shared_cache import SharedTokenCache
+from issuers import IssuerRegistry, UnknownIssuerError
+from jwks_manager import JwksKeyManager, JwksUnavailableError, UnknownKidError
+from jwks_snapshot import SnapshotStore
+from metrics import MetricsMiddleware, Registry, current_request_id, record_timing
+from token_cache import NegativeCache, VerifiedTokenCache, token_digest
+from verifier import SUPPORTED_ALGORITHMS, parse_token
+
 # ====== 設定（環境変数から） ======
 KC_BASE = os.environ["KC_BASE"].rstrip("/")
 REALM = os.environ["REALM"]
@@ -15,87 +48,696 @@ REALM = os.environ["REALM"]
 API_CLIENT_ID = os.getenv("API_CLIENT_ID", "backend-api")
 
 ISSUER = f"{KC_BASE}/realms/{REALM}"
-JWKS_URL = f"{ISSUER}/protocol/openid-connect/certs"
 
-# ====== 準備：JWKS クライアント（PyJWT が内部でキャッシュしてくれます） ======
-_jwks_client = PyJWKClient(JWKS_URL)
+# 受け付ける発行者（iss）の許可リスト。既定は REALM のみ
+#   ALLOWED_REALMS:  KC_BASE 配下の Realm 名（カンマ区切り）
+#   ALLOWED_ISSUERS: 発行者 URL そのもの（カンマ区切り。別の Keycloak も指定可）
+ALLOWED_ISSUERS = {ISSUER}
+ALLOWED_ISSUERS.update(
+    f"{KC_BASE}/realms/{r.strip()}" for r in os.getenv("ALLOWED_REALMS", "").split(",") if r.strip()
+)
+ALLOWED_ISSUERS.update(i.strip() for i in os.getenv("ALLOWED_ISSUERS", "").split(",") if i.strip())
+# 同時に鍵を保持する発行者の上限と、使われなくなった発行者を破棄するまでの秒数
+ISSUER_CACHE_SIZE = int(os.getenv("ISSUER_CACHE_SIZE", "64"))
+ISSUER_IDLE_TTL = float(os.getenv("ISSUER_IDLE_TTL", "3600"))
+
+# JWKS の定期更新間隔（秒）と、Keycloak へのリクエストタイムアウト（秒）
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", "5"))
+# 未知の kid をきっかけにした JWKS 再取得の最小間隔（秒）
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("JWKS_MIN_REFETCH_INTERVAL", "10"))
+# OIDC ディスカバリ（.well-known/openid-configuration）で jwks_uri を求めるか
+OIDC_DISCOVERY = os.getenv("OIDC_DISCOVERY", "0") == "1"
+# ディスカバリ情報と JWKS のスナップショットを保存するディレクトリ（空なら無効）と、使用を許す最大経過秒数
+JWKS_SNAPSHOT_DIR = os.getenv("JWKS_SNAPSHOT_DIR", "")
+JWKS_SNAPSHOT_MAX_AGE = float(os.getenv("JWKS_SNAPSHOT_MAX_AGE", "86400"))
+
+# 受け付ける署名アルゴリズム（RS256 / PS256 / ES256 / EdDSA から選ぶ）
+ALLOWED_ALGORITHMS = frozenset(
+    a.strip() for a in os.getenv("ALLOWED_ALGORITHMS", "RS256,PS256,ES256,EdDSA").split(",") if a.strip()
+)
+if not ALLOWED_ALGORITHMS <= SUPPORTED_ALGORITHMS:
+    raise ValueError(f"unsupported ALLOWED_ALGORITHMS: {sorted(ALLOWED_ALGORITHMS - SUPPORTED_ALGORITHMS)}")
+
+# 署名検証を実行するプール（thread / process / inline）とワーカー数（未指定なら CPU 数）
+VERIFY_EXECUTOR = os.getenv("VERIFY_EXECUTOR", "thread")
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", "0")) or None
+
+# レスポンスに Server-Timing ヘッダ（処理フェーズごとの所要時間）を付けるか
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+# リクエストごとのフェーズ内訳を X-Request-ID 付きでログに出すか（クライアント側の計測と突き合わせるため）
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "0") == "1"
+
+# 検証済みトークンキャッシュ（オプトイン：TOKEN_CACHE_SIZE > 0 で有効化）
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "0"))
+# exp より前でも、この秒数を過ぎたエントリは再検証する
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# 全ワーカーで共有する検証済みトークンキャッシュ（mmap するファイルのパス。空なら無効）
+#   例: SHARED_CACHE_PATH=/dev/shm/keycloak-auth.cache（uvicorn --workers N でも検証は 1 回で済む）
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", "4096"))
+SHARED_CACHE_SLOT_SIZE = int(os.getenv("SHARED_CACHE_SLOT_SIZE", "1024"))
+
+# 拒否済みトークンのネガティブキャッシュ（0 で無効）
+REJECTED_CACHE_SIZE = int(os.getenv("REJECTED_CACHE_SIZE", "4096"))
+REJECTED_CACHE_TTL = float(os.getenv("REJECTED_CACHE_TTL", "60"))
+
+# トークンイントロスペクション（ログアウト・失効の検知）
+#   off:    ローカル検証のみ（既定）
+#   always: ローカル検証に加え、全リクエストでイントロスペクション（結果はキャッシュ）
+#   hybrid: 発行から INTROSPECTION_MIN_AGE 秒を過ぎたトークンと、INTROSPECTION_PATHS 配下のみ
+INTROSPECTION_MODE = os.getenv("INTROSPECTION_MODE", "off")
+if INTROSPECTION_MODE not in ("off", "always", "hybrid"):
+    raise ValueError(f"unknown INTROSPECTION_MODE: {INTROSPECTION_MODE}")
+# 空なら発行者（iss）ごとに {iss}/protocol/openid-connect/token/introspect を使う
+INTROSPECTION_URL = os.getenv("INTROSPECTION_URL", "")
+INTROSPECTION_CLIENT_ID = os.getenv("INTROSPECTION_CLIENT_ID", API_CLIENT_ID)
+INTROSPECTION_CLIENT_SECRET = os.getenv("INTROSPECTION_CLIENT_SECRET")
+# active=true / active=false の結果をキャッシュする秒数（true の方はトークンの exp も上限）
+INTROSPECTION_CACHE_TTL = float(os.getenv("INTROSPECTION_CACHE_TTL", "30"))
+INTROSPECTION_NEGATIVE_TTL = float(os.getenv("INTROSPECTION_NEGATIVE_TTL", "300"))
+INTROSPECTION_CACHE_SIZE = int(os.getenv("INTROSPECTION_CACHE_SIZE", "10000"))
+INTROSPECTION_MAX_CONNECTIONS = int(os.getenv("INTROSPECTION_MAX_CONNECTIONS", "20"))
+INTROSPECTION_MIN_AGE = float(os.getenv("INTROSPECTION_MIN_AGE", "60"))
+INTROSPECTION_PATHS = tuple(
+    p.strip() for p in os.getenv("INTROSPECTION_PATHS", "/authorize").split(",") if p.strip()
+)
+
+# 認証・認可判定の監査ログ（JSON Lines の出力先。空なら無効）
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+AUDIT_LOG_BACKUPS = int(os.getenv("AUDIT_LOG_BACKUPS", "5"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+# キューがあふれそうなとき: drop（新しいものを捨てる）/ sample（allow を AUDIT_SAMPLE_RATE の割合に間引く）
+AUDIT_OVERFLOW = os.getenv("AUDIT_OVERFLOW", "drop")
+AUDIT_SAMPLE_RATE = float(os.getenv("AUDIT_SAMPLE_RATE", "0.1"))
+
+# 外部認可エンドポイント（/ext-authz）のパスごとのロール要件と、本人情報ヘッダの接頭辞
+#   例: EXT_AUTHZ_RULES="/admin=app:owner;/reports=app:reader"
+EXT_AUTHZ_RULES = PathRules.parse(os.getenv("EXT_AUTHZ_RULES", ""), API_CLIENT_ID)
+EXT_AUTHZ_HEADER_PREFIX = os.getenv("EXT_AUTHZ_HEADER_PREFIX", "x-auth-")
+# /ext-authz-batch の共有シークレット（X-Ext-Authz-Secret ヘッダで送る）。空なら /ext-authz-batch は無効（404）
+#   誰でも呼べるとトークンの有効性を一括で調べられてしまうため、既定では公開しない
+EXT_AUTHZ_BATCH_SECRET = os.getenv("EXT_AUTHZ_BATCH_SECRET", "")
+# /ext-authz-batch で 1 回に受け付けるトークン数の上限
+EXT_AUTHZ_BATCH_MAX = int(os.getenv("EXT_AUTHZ_BATCH_MAX", "1000"))
+# /ext-authz-batch で受け付けるリクエストボディの上限（バイト）
+EXT_AUTHZ_BATCH_MAX_BYTES = int(os.getenv("EXT_AUTHZ_BATCH_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# ====== 準備：メトリクス（/metrics で Prometheus テキスト形式として公開） ======
+metrics = Registry()
+_verify_seconds = metrics.histogram(
+    "auth_token_verify_seconds", "Time spent verifying bearer tokens", ["outcome"]
+)
+_jwks_fetch_seconds = metrics.histogram(
+    "auth_jwks_fetch_seconds", "Time spent fetching the JWKS from Keycloak", ["result"]
+)
+_denials = metrics.counter(
+    "auth_denials_total", "Requests rejected by authentication or authorization", ["reason"]
+)
+_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request time per route", ["method", "route", "status"]
+)
+
+
+def _record_jwks_fetch(seconds: float, ok: bool) -> None:
+    _jwks_fetch_seconds.observe(seconds, "ok" if ok else "error")
+
+
+# ====== 準備：発行者ごとの JWKS 鍵マネージャ（初回利用時にウォームアップし、バックグラウンドで更新） ======
+_snapshots = (
+    SnapshotStore(JWKS_SNAPSHOT_DIR, max_age=JWKS_SNAPSHOT_MAX_AGE) if JWKS_SNAPSHOT_DIR else None
+)
+
+
+def _new_jwks_manager(issuer: str) -> JwksKeyManager:
+    return JwksKeyManager(
+        jwks_url=None if OIDC_DISCOVERY else IssuerRegistry.jwks_url(issuer),
+        discovery_url=IssuerRegistry.discovery_url(issuer) if OIDC_DISCOVERY else None,
+        issuer=issuer,
+        snapshot=_snapshots,
+        refresh_interval=JWKS_REFRESH_INTERVAL,
+        fetch_timeout=JWKS_FETCH_TIMEOUT,
+        min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+        on_fetch=_record_jwks_fetch,
+    )
+
+
+_issuers = IssuerRegistry(
+    ALLOWED_ISSUERS,
+    _new_jwks_manager,
+    max_active=ISSUER_CACHE_SIZE,
+    idle_ttl=ISSUER_IDLE_TTL,
+)
+
+# ====== 準備：署名検証プール（RSA 検証をイベントループ外で実行） ======
+_crypto_pool = CryptoPool(kind=VERIFY_EXECUTOR, workers=VERIFY_WORKERS)
+
+# ====== 準備：検証済みトークンキャッシュ（同一トークンの RSA 検証をスキップ） ======
+_token_cache = (
+    VerifiedTokenCache(max_size=TOKEN_CACHE_SIZE, ttl_seconds=TOKEN_CACHE_TTL)
+    if TOKEN_CACHE_SIZE > 0
+    else None
+)
+
+# ====== 準備：ワーカー間共有キャッシュ（他のワーカーが検証したトークンも再検証しない） ======
+_shared_cache = (
+    SharedTokenCache(
+        SHARED_CACHE_PATH,
+        slots=SHARED_CACHE_SLOTS,
+        slot_size=SHARED_CACHE_SLOT_SIZE,
+        ttl_seconds=TOKEN_CACHE_TTL,
+    )
+    if SHARED_CACHE_PATH
+    else None
+)
+
+# ====== 準備：拒否済みトークンのネガティブキャッシュ（不正トークンの再検証をスキップ） ======
+_rejected_cache = (
+    NegativeCache(max_size=REJECTED_CACHE_SIZE, ttl_seconds=REJECTED_CACHE_TTL)
+    if REJECTED_CACHE_SIZE > 0
+    else None
+)
+
+# ====== 準備：トークンイントロスペクション（INTROSPECTION_MODE が off 以外で有効） ======
+_introspector = (
+    TokenIntrospector(
+        INTROSPECTION_CLIENT_ID,
+        INTROSPECTION_CLIENT_SECRET,
+        timeout=JWKS_FETCH_TIMEOUT,
+        max_connections=INTROSPECTION_MAX_CONNECTIONS,
+        positive_ttl=INTROSPECTION_CACHE_TTL,
+        negative_ttl=INTROSPECTION_NEGATIVE_TTL,
+        max_size=INTROSPECTION_CACHE_SIZE,
+    )
+    if INTROSPECTION_MODE != "off"
+    else None
+)
+
+# ====== 準備：監査ログ（判定をキューに積み、バックグラウンドでまとめて書き出す） ======
+# 複数ワーカーでも同じ AUDIT_LOG_PATH に書いてよい（書き込みとローテーションは flock で排他する）
+_audit_log = (
+    AuditLog(
+        JsonlFileSink(AUDIT_LOG_PATH, max_bytes=AUDIT_LOG_MAX_BYTES, backups=AUDIT_LOG_BACKUPS),
+        max_queue=AUDIT_QUEUE_SIZE,
+        batch_size=AUDIT_BATCH_SIZE,
+        flush_interval=AUDIT_FLUSH_INTERVAL,
+        overflow=AUDIT_OVERFLOW,
+        sample_rate=AUDIT_SAMPLE_RATE,
+    )
+    if AUDIT_LOG_PATH
+    else None
+)
 
 # ====== FastAPI アプリ ======
-app = FastAPI(title="Minimal Keycloak-protected API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 既定の Realm だけは起動時にウォームアップしておく
+    _issuers.get(ISSUER)
+    if _audit_log is not None:
+        _audit_log.start()
+    yield
+    if _audit_log is not None:
+        _audit_log.stop()
+    _issuers.stop()
+    _crypto_pool.shutdown()
+    if _shared_cache is not None:
+        _shared_cache.close()
+    if _introspector is not None:
+        await _introspector.aclose()
+
+
+timing_logger = logging.getLogger("keycloak_auth.timing")
+
+
+def _log_timing(request_id: str, method: str, route: str, status_code: int, phases: List[Tuple[str, float]]) -> None:
+    timing_logger.info(
+        "request_id=%s method=%s route=%s status=%d %s",
+        request_id, method, route, status_code,
+        " ".join(f"{name}={sec * 1000:.3f}ms" for name, sec in phases),
+    )
+
+
+app = FastAPI(title="Minimal Keycloak-protected API", lifespan=lifespan)
+app.add_middleware(
+    MetricsMiddleware,
+    histogram=_request_seconds,
+    server_timing=SERVER_TIMING,
+    on_timing=_log_timing if REQUEST_TIMING_LOG else None,
+)
+
+if _token_cache is not None:
+    metrics.gauge_func("auth_token_cache_hits", "Verified token cache hits", lambda: _token_cache.hits)
+    metrics.gauge_func("auth_token_cache_misses", "Verified token cache misses", lambda: _token_cache.misses)
+if _shared_cache is not None:
+    metrics.gauge_func("auth_shared_cache_hits", "Shared token cache hits", lambda: _shared_cache.hits)
+    metrics.gauge_func("auth_shared_cache_misses", "Shared token cache misses", lambda: _shared_cache.misses)
+if _rejected_cache is not None:
+    metrics.gauge_func("auth_rejected_cache_hits", "Rejected token cache hits", lambda: _rejected_cache.hits)
+if _introspector is not None:
+    metrics.gauge_func(
+        "auth_introspection_requests", "Introspection calls sent to Keycloak", lambda: _introspector.requests
+    )
+if _audit_log is not None:
+    metrics.gauge_func("auth_audit_dropped", "Audit records dropped on a full queue", lambda: _audit_log.dropped)
+    metrics.gauge_func("auth_audit_sampled_out", "Audit records skipped by sampling", lambda: _audit_log.sampled_out)
+metrics.gauge_func("auth_active_issuers", "Issuers with a loaded key set", lambda: _issuers.stats()["active"])
 
 # “Authorization: Bearer <token>” を受け取るための簡易セキュリティスキーム
 bearer_scheme = HTTPBearer(auto_error=True)
 
-def verify_access_token(
+async def verify_access_token(
+    request: Request,
     creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-) -> Dict[str, Any]:
+) -> Principal:
     """
     Authorization ヘッダの Bearer トークンを受け取り、
-    Keycloak の公開鍵(JWKS)で署名検証してデコードする最小実装。
+    Keycloak の公開鍵(JWKS)で署名検証して呼び出し元（Principal）を返す最小実装。
+    """
+    return await authenticate_token(creds.credentials, request.url.path)
+
+
+async def authenticate_token(token: str, path: str = "/") -> Principal:
+    """
+    トークンを検証して呼び出し元を返す（ルートの依存関係と外部認可で共用）。
+    イントロスペクションが有効なら、ローカル検証の後に失効していないかも確かめる。
+    """
+    started = time.perf_counter()
+    try:
+        principal = await _verify_locally(token)
+        if _introspector is not None and _needs_introspection(principal, path):
+            await _check_active(token, principal)
+    except HTTPException as e:
+        if _audit_log is not None:
+            _audit_log.record(
+                "deny", path, e.detail, time.perf_counter() - started,
+                status=e.status_code, request_id=current_request_id(),
+            )
+        raise
+    if _audit_log is not None:
+        _audit_log.record(
+            "allow", path, "authenticated", time.perf_counter() - started, principal,
+            request_id=current_request_id(),
+        )
+    return principal
+
+
+async def _verify_locally(token: str) -> Principal:
     """
-    token = creds.credentials
+    署名と発行者をローカルで検証し、呼び出し元（Principal）を作る。
+
+    キャッシュ参照やヘッダ解析などの軽い処理はイベントループ上で行い、
+    JWKS の取得は await、署名検証は専用プール（_crypto_pool）で実行する。
+    """
+    started = time.perf_counter()
+    if _token_cache is not None:
+        cached = _token_cache.get(token)
+        if cached is not None:
+            _finish_verify(started, "cache_hit")
+            return cached
+
+    digest = token_digest(token)
+    if _rejected_cache is not None:
+        reason = _rejected_cache.get(digest)
+        if reason is not None:
+            _finish_verify(started, "rejected_cached")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Invalid token: {reason}",
+            )
+
+    if _shared_cache is not None:
+        shared = _shared_cache.get(digest)
+        if shared is not None:
+            # 他のワーカーが検証済み。以降はこのワーカーのキャッシュから返す
+            principal = Principal.from_claims(shared, token)
+            if _token_cache is not None:
+                _token_cache.put(token, principal)
+            _finish_verify(started, "cache_hit")
+            return principal
+
     try:
-        signing_key = _jwks_client.get_signing_key_from_jwt(token).key
-
-        # 最小：署名と iss（発行者）だけ検証（aud 検証はオフ）
-        # 監査を強めたい場合は options を外し、aud=EXPECTED_AUD を指定して下さい。
-        payload = jwt.decode(
-            token,
-            signing_key,
-            algorithms=["RS256"],
-            issuer=ISSUER,
-            options={"verify_aud": False},  # 最小化のため audience 検証は無効
-            # audience=EXPECTED_AUD,        # 監査強化したい場合はこちらを使う
+        # 署名検証前のヘッダ/ペイロードから kid と iss を取り出し、発行者ごとの鍵セットへ振り分ける
+        # トークンの分解はこの 1 回だけで、署名検証でも同じ結果を使う
+        parsed = parse_token(token)
+        issuer = parsed.claims.get("iss")
+        key_started = time.perf_counter()
+        jwks_manager = await _issuers.aget(issuer)
+        signing_key = await jwks_manager.aget_signing_key(parsed.kid)
+        record_timing("key", time.perf_counter() - key_started)
+
+        # 最小：署名と iss（発行者）と有効期限だけ検証（aud 検証はオフ）
+        # 監査を強めたい場合は verifier.validate_claims で aud=EXPECTED_AUD も確認して下さい。
+        crypto_started = time.perf_counter()
+        payload = await _crypto_pool.verify(
+            parsed,
+            signing_key,  # kid ごとに準備済みの鍵。鍵の alg 以外で署名されたトークンは拒否する
+            issuer=issuer,
+            allowed_algorithms=ALLOWED_ALGORITHMS,
         )
-        return payload
+        record_timing("signature", time.perf_counter() - crypto_started)
+        # ルートが使う項目だけを取り出し、クレーム全体（dict）はキャッシュに載せない
+        principal = Principal.from_claims(payload, token)
+        if _token_cache is not None:
+            _token_cache.put(token, principal)
+        if _shared_cache is not None:
+            _shared_cache.put(digest, payload)
+        _finish_verify(started, "verified")
+        return principal
 
     except InvalidTokenError as e:
-        # 署名不正／期限切れなど
+        # 署名不正／期限切れなど。nbf/iat 前のトークンと、鍵のローテーション直後で kid が
+        # まだ手元に無いだけのトークンは後で有効になり得るので記録しない
+        if _rejected_cache is not None and not isinstance(e, (ImmatureSignatureError, UnknownKidError)):
+            _rejected_cache.add(digest, str(e))
+        _finish_verify(started, _denial_reason(e))
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid token: {e}",
+        )
+    except JwksUnavailableError as e:
+        # 鍵を一度も取得できていない（Keycloak 停止中など）
+        _finish_verify(started, "jwks_unavailable")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Signing keys unavailable: {e}",
+        )
+
+
+def _needs_introspection(principal: Principal, path: str) -> bool:
+    if INTROSPECTION_MODE == "always":
+        return True
+    if any(path.startswith(prefix) for prefix in INTROSPECTION_PATHS):
+        return True
+    return token_age(principal.issued_at) >= INTROSPECTION_MIN_AGE
+
+
+async def _check_active(token: str, principal: Principal) -> None:
+    """イントロスペクションで失効していないか確かめる（結果はキャッシュされ、同時の問い合わせは 1 回にまとまる）。"""
+    endpoint = INTROSPECTION_URL or f"{principal.issuer}/protocol/openid-connect/token/introspect"
+    started = time.perf_counter()
+    try:
+        await _introspector.introspect(endpoint, token)
+    except TokenInactiveError as e:
+        _denials.inc("inactive")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid token: {e}",
         )
+    except IntrospectionUnavailableError as e:
+        # 失効を確認できない場合は通さない（fail closed）
+        _denials.inc("introspection_unavailable")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+        )
+    finally:
+        record_timing("introspect", time.perf_counter() - started)
+
+
+def _denial_reason(e: InvalidTokenError) -> str:
+    if isinstance(e, ExpiredSignatureError):
+        return "expired"
+    if isinstance(e, UnknownKidError):
+        return "unknown_kid"
+    if isinstance(e, UnknownIssuerError):
+        return "unknown_issuer"
+    if isinstance(e, InvalidSignatureError):
+        return "bad_signature"
+    if isinstance(e, InvalidIssuerError):
+        return "bad_issuer"
+    if isinstance(e, InvalidAlgorithmError):
+        return "bad_algorithm"
+    return "invalid_token"
 
-def has_client_role(claims: Dict[str, Any], client_id: str, role: str) -> bool:
-    roles: List[str] = (
-        (claims.get("resource_access") or {})
-        .get(client_id, {})
-        .get("roles", [])
+
+def _finish_verify(started: float, outcome: str) -> None:
+    """検証結果ごとの所要時間を記録し、拒否なら理由別に数える。"""
+    elapsed = time.perf_counter() - started
+    record_timing("auth", elapsed)
+    if outcome in ("verified", "cache_hit"):
+        _verify_seconds.observe(elapsed, outcome)
+    else:
+        _verify_seconds.observe(elapsed, "rejected")
+        _denials.inc(outcome)
+
+# ====== 認可ポリシー ======
+
+def _audit_policy(
+    allowed: bool, policy: RolePolicy, roles: RoleSet, principal: Principal, route: str, started: float
+) -> None:
+    if _audit_log is None:
+        return
+    if allowed:
+        _audit_log.record(
+            "allow", route, "authorized", time.perf_counter() - started, principal,
+            request_id=current_request_id(),
+        )
+    else:
+        _audit_log.record(
+            "deny", route, f"missing_role: {policy.missing(roles)}",
+            time.perf_counter() - started, principal, status=status.HTTP_403_FORBIDDEN,
+            request_id=current_request_id(),
+        )
+
+
+def _policy_dependency(policy: RolePolicy):
+    async def check(
+        request: Request,
+        principal: Principal = Depends(verify_access_token),
+    ) -> RoleSet:
+        started = time.perf_counter()
+        roles = principal.roles
+        allowed = policy.allows(roles)
+        _audit_policy(allowed, policy, roles, principal, request.url.path, started)
+        if not allowed:
+            _denials.inc("missing_role")
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Forbidden: missing {policy.missing(roles)}",
+            )
+        return roles
+    return check
+
+
+def require_roles(
+    *client_roles: str,
+    realm: Iterable[str] = (),
+    client_id: str = API_CLIENT_ID,
+):
+    """
+    指定ロールを「すべて」要求する依存関係を作る（ポリシーは作成時に 1 回だけコンパイル）。
+    例: Depends(require_roles("app:owner")) / Depends(require_roles(realm=["admin"]))
+    """
+    return _policy_dependency(
+        RolePolicy(realm=realm, client={client_id: client_roles}, mode="all")
+    )
+
+
+def require_any(
+    *client_roles: str,
+    realm: Iterable[str] = (),
+    client_id: str = API_CLIENT_ID,
+):
+    """指定ロールの「いずれか」を要求する依存関係を作る。"""
+    return _policy_dependency(
+        RolePolicy(realm=realm, client={client_id: client_roles}, mode="any")
     )
-    return role in roles
 
 # ====== ルート ======
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """検証済み（ワーカー内/共有）/拒否済みトークンキャッシュと JWKS 鍵マネージャの統計を返す。"""
+    return {
+        "verified": _token_cache.stats() if _token_cache is not None else {"enabled": False},
+        "shared": _shared_cache.stats() if _shared_cache is not None else {"enabled": False},
+        "rejected": _rejected_cache.stats() if _rejected_cache is not None else {"enabled": False},
+        "jwks": _issuers.stats(),
+        "introspection": _introspector.stats() if _introspector is not None else {"enabled": False},
+        "audit": _audit_log.stats() if _audit_log is not None else {"enabled": False},
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus テキスト形式のメトリクス。"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class ProtectedResponse(BaseModel):
+    message: str
+    sub: Optional[str]
+    preferred_username: Optional[str]
+    scope: Optional[str]
+    realm_roles: Optional[List[str]]
+
+
 @app.get("/protected")
-def protected(claims: Dict[str, Any] = Depends(verify_access_token)):
+async def protected(principal: Principal = Depends(verify_access_token)) -> ProtectedResponse:
     """
     Keycloak アクセストークンが有効なら通る保護 API の最小例。
     代表的なクレームを返すだけ。
     """
-    # よく使うクレーム例：
+    # よく使う項目（Principal）：
     #  - sub: 一意ID
-    #  - preferred_username: ユーザー名
-    #  - scope: アクセストークンのスコープ
-    #  - realm_access / resource_access: ロール情報
-    return {
-        "message": "You are authenticated!",
-        "sub": claims.get("sub"),
-        "preferred_username": claims.get("preferred_username"),
-        "scope": claims.get("scope"),
-        "realm_roles": (claims.get("realm_access") or {}).get("roles"),
-    }
+    #  - username: ユーザー名（preferred_username）
+    #  - scope: アクセストークンのスコープ（文字列のまま。集合は scopes）
+    #  - realm_roles / roles: realm ロールの並び / realm・client ロールの集合
+    # 戻り値の型を宣言しているので、FastAPI が Pydantic で直接 JSON バイト列にする（jsonable_encoder を通らない）
+    return ProtectedResponse(
+        message="You are authenticated!",
+        sub=principal.sub,
+        preferred_username=principal.username,
+        scope=principal.scope,
+        realm_roles=list(principal.realm_roles) if principal.realm_roles is not None else None,
+    )
 
 
-@app.get("/authorize")
-def authorize(claims: Dict[str, Any] = Depends(verify_access_token)):
+@app.get("/authorize", dependencies=[Depends(require_roles("app:owner"))])
+async def authorize():
     """
-    有効なアクセストークン + clientロール `api:owner` が必要
+    有効なアクセストークン + clientロール `app:owner` が必要
     付与先クライアントは backend-api（= API_CLIENT_ID）
     """
-    if not has_client_role(claims, API_CLIENT_ID, "app:owner"):
-        raise HTTPException(status_code=403, detail="Forbidden: missing app:owner")
     return {"message": "You are authorized for /authorize"}
+
+
+# ====== 外部認可（Envoy ext_authz / NGINX auth_request） ======
+# 認証・認可の結果だけをステータスと本人情報ヘッダで返し、ボディは返さない。
+# ゲートウェイからのみ到達できる場所に公開すること。
+_EXT_AUTHZ_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+async def _authz_decision(
+    token: Optional[str], path: Optional[str]
+) -> Tuple[int, Optional[Principal], Optional[str]]:
+    """
+    authenticate_token とパスのロール要件で判定する。
+    path は original_path で正規化したもの。正規化できなかった（None）パスはルールと照合できないので拒否する。
+
+    Returns:
+        (ステータス, 呼び出し元, 拒否理由)。許可なら 200 と理由 None
+    """
+    if token is None:
+        return status.HTTP_401_UNAUTHORIZED, None, "Not authenticated"
+    if path is None:
+        _denials.inc("bad_path")
+        return status.HTTP_403_FORBIDDEN, None, "Forbidden: non-canonical path"
+    try:
+        principal = await authenticate_token(token, path)
+    except HTTPException as e:
+        return e.status_code, None, e.detail
+
+    policy = EXT_AUTHZ_RULES.policy_for(path)
+    if policy is None:
+        return status.HTTP_200_OK, principal, None
+    started = time.perf_counter()
+    roles = principal.roles
+    allowed = policy.allows(roles)
+    _audit_policy(allowed, policy, roles, principal, path, started)
+    if not allowed:
+        _denials.inc("missing_role")
+        return status.HTTP_403_FORBIDDEN, principal, f"Forbidden: missing {policy.missing(roles)}"
+    return status.HTTP_200_OK, principal, None
+
+
+class AuthzCheck(BaseModel):
+    token: str
+    path: str = "/"
+
+
+class AuthzBatch(BaseModel):
+    checks: List[AuthzCheck]
+
+
+def require_batch_secret(request: Request) -> None:
+    """/ext-authz-batch の入口チェック。ボディを読む前に、無効なら 404、シークレット違いなら 403 を返す。"""
+    if not EXT_AUTHZ_BATCH_SECRET:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not hmac.compare_digest(
+        request.headers.get("x-ext-authz-secret", "").encode(), EXT_AUTHZ_BATCH_SECRET.encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+async def _read_body_limited(request: Request, limit: int) -> bytes:
+    """リクエストボディを limit バイトまで読む。超えたら（Content-Length でも実際の長さでも）413。"""
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Request body too large (max {limit} bytes)",
+    )
+    length = request.headers.get("content-length")
+    if length is not None and (not length.isdigit() or int(length) > limit):
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+
+@app.post("/ext-authz-batch", dependencies=[Depends(require_batch_secret)])
+async def ext_authz_batch(request: Request):
+    """
+    複数トークンをまとめて判定する（ゲートウェイの一括再検証用）。
+    結果は checks と同じ順序で {"allow", "status", "sub", "reason"} を返す。
+    EXT_AUTHZ_BATCH_SECRET を設定し、同じ値を X-Ext-Authz-Secret ヘッダで送った場合だけ使える。
+    ボディ（AuthzBatch）はシークレットとサイズを確かめてから読む（認証前にパースさせない）。
+    """
+    try:
+        batch = AuthzBatch.model_validate_json(
+            await _read_body_limited(request, EXT_AUTHZ_BATCH_MAX_BYTES)
+        )
+    except ValidationError as e:
+        # 通常のボディ引数と同じ形（loc が "body" から始まる 422）で返す
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+    if len(batch.checks) > EXT_AUTHZ_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many checks (max {EXT_AUTHZ_BATCH_MAX})",
+        )
+    decisions = await asyncio.gather(
+        *(_authz_decision(c.token, original_path(c.path)) for c in batch.checks)
+    )
+    return {
+        "results": [
+            batch_result(status_code, principal, reason)
+            for status_code, principal, reason in decisions
+        ]
+    }
+
+
+@app.api_route("/ext-authz", methods=_EXT_AUTHZ_METHODS)
+@app.api_route("/ext-authz/{path:path}", methods=_EXT_AUTHZ_METHODS)
+async def ext_authz(request: Request, path: Optional[str] = None):
+    """
+    外部認可チェック。許可なら 200 + 本人情報ヘッダ、拒否なら 401/403/503（ボディなし）。
+
+    元のパスは次の順で求める:
+      - Envoy（path_prefix: /ext-authz）: /ext-authz/<元のパス>
+      - NGINX auth_request: X-Original-URI ヘッダ
+      - Traefik forwardAuth: X-Forwarded-Uri ヘッダ
+    """
+    headers = request.headers
+    if path is None:
+        path = headers.get("x-original-uri") or headers.get("x-forwarded-uri") or "/"
+    status_code, principal, _ = await _authz_decision(
+        bearer_token(headers.get("authorization")), original_path(path)
+    )
+    if status_code == status.HTTP_200_OK:
+        return Response(
+            status_code=status_code,
+            headers=identity_headers(principal, API_CLIENT_ID, EXT_AUTHZ_HEADER_PREFIX),
+        )
+    if status_code == status.HTTP_401_UNAUTHORIZED:
+        return Response(status_code=status_code, headers={"www-authenticate": "Bearer"})
+    return Response(status_code=status_code)
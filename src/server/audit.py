@@ -0,0 +1,207 @@
+import fcntl
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from principal import Principal
+
+logger = logging.getLogger(__name__)
+
+
+class JsonlFileSink:
+    """
+    監査レコードを JSON Lines で追記するシンク。max_bytes を超えたら .1, .2, ... にローテーションする。
+    独自のシンクは write(records) と close() を持つオブジェクトであればよい。
+
+    uvicorn --workers N のように複数プロセスが同じ path に書く場合に備え、
+    書き込みとローテーションは {path}.lock の flock でプロセス間排他する。
+    書く前に path の inode を確かめ、他のワーカーがローテーション済みなら開き直す
+    （ファイルはワーカーごとに分けず、1 本のまま）。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _reopen_if_rotated(self) -> None:
+        """path が別のファイルに置き換わっていたら（他のワーカーのローテーション）開き直す。"""
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                return
+        except FileNotFoundError:
+            pass
+        self._file.close()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, separators=(",", ":"), ensure_ascii=False) + "\n" for r in records)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            self._reopen_if_rotated()
+            self._file.write(data)
+            self._file.flush()
+            if self.max_bytes and os.fstat(self._file.fileno()).st_size >= self.max_bytes:
+                self._rotate()
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        self._file.close()
+        os.close(self._lock_fd)
+
+
+class AuditLog:
+    """
+    認証・認可の判定（allow / deny）を非同期にまとめて書き出す監査ログ。
+
+    - record() は有界キューに積むだけで、I/O はバックグラウンドスレッドがバッチで行う
+    - キューがあふれそうなときの扱いは overflow で選ぶ
+        drop:   満杯になったら新しいレコードを捨てる
+        sample: 半分を超えたら allow は sample_rate の割合だけ残し、deny は満杯まで残す
+    - 捨てた件数は dropped / sampled_out として数える（リクエスト処理を待たせることはしない）
+    """
+
+    def __init__(
+        self,
+        sink,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = "drop",
+        sample_rate: float = 0.1,
+    ):
+        if overflow not in ("drop", "sample"):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.write_errors = 0
+
+    def record(
+        self,
+        decision: str,
+        route: str,
+        reason: str,
+        latency: float,
+        principal: Optional[Principal] = None,
+        status: Optional[int] = None,
+        request_id: Optional[str] = None,
+    ) -> None:
+        """判定を 1 件記録する（ブロックしない）。"""
+        if (
+            self.overflow == "sample"
+            and decision == "allow"
+            and self._queue.qsize() * 2 >= self.max_queue
+            and random.random() >= self.sample_rate
+        ):
+            self.sampled_out += 1
+            return
+        entry = {
+            "ts": round(time.time(), 3),
+            "decision": decision,
+            "sub": principal.sub if principal is not None else None,
+            "client": principal.client if principal is not None else None,
+            "route": route,
+            "reason": reason,
+            "latency_ms": round(latency * 1000, 3),
+        }
+        if status is not None:
+            entry["status"] = status
+        if request_id is not None:
+            entry["request_id"] = request_id
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first: Dict[str, Any]) -> List[Dict[str, Any]]:
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            self.sink.write(batch)
+            self.written += len(batch)
+        except Exception as e:
+            # 書き込みに失敗しても判定処理には影響させない
+            self.write_errors += 1
+            logger.warning("Failed to write %d audit records: %s", len(batch), e)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            self._write(self._drain(first))
+
+    def start(self) -> "AuditLog":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """書き込みスレッドを止め、キューに残ったレコードを書き出してからシンクを閉じる。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while True:
+            try:
+                first = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._write(self._drain(first))
+        self.sink.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from cryptography.hazmat.primitives import serialization
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import InvalidSignatureError
+
+from verifier import SUPPORTED_ALGORITHMS, ParsedToken, PreparedKey, validate_claims, verify_token
+
+
+# ====== プロセスプール側で動く関数（pickle できるようモジュールレベルに置く） ======
+@functools.lru_cache(maxsize=64)
+def _load_public_key(pem: bytes):
+    """PEM から公開鍵オブジェクトを復元する。ワーカープロセスごとにキャッシュする。"""
+    return serialization.load_pem_public_key(pem)
+
+
+@functools.lru_cache(maxsize=None)
+def _algorithm(alg: str):
+    return get_default_algorithms()[alg]
+
+
+def _verify_with_pem(alg: str, pem: bytes, signing_input: bytes, signature: bytes) -> bool:
+    return _algorithm(alg).verify(signing_input, _load_public_key(pem), signature)
+
+
+class CryptoPool:
+    """
+    JWT の署名検証（RSA などの重い処理）をイベントループ外で実行する専用プール。
+
+    - kind="thread": スレッドプール。cryptography は検証中に GIL を解放するので多くの場合これで十分
+    - kind="process": プロセスプール。公開鍵は PEM で渡し、ワーカー側で復元してキャッシュする
+    - kind="inline": イベントループ上でそのまま検証する。ES256 / EdDSA など検証が速い鍵では、
+      スレッドへの受け渡しの方が高くつくことがある（bench/verify_bench.py で比較できる）
+    """
+
+    def __init__(self, kind: str = "thread", workers: Optional[int] = None):
+        if kind not in ("thread", "process", "inline"):
+            raise ValueError(f"unknown executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        # id(key) -> (key, pem)。key を保持しておくことで id の再利用を防ぐ
+        self._pem_cache: Dict[int, Tuple[Any, bytes]] = {}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="jwt-verify"
+                        )
+        return self._executor
+
+    def _pem(self, key: Any) -> bytes:
+        entry = self._pem_cache.get(id(key))
+        if entry is not None and entry[0] is key:
+            return entry[1]
+        pem = key.public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        if len(self._pem_cache) >= 64:
+            self._pem_cache.clear()
+        self._pem_cache[id(key)] = (key, pem)
+        return pem
+
+    async def verify(
+        self,
+        parsed: ParsedToken,
+        key: PreparedKey,
+        issuer: Optional[str] = None,
+        allowed_algorithms: Iterable[str] = SUPPORTED_ALGORITHMS,
+    ) -> Dict[str, Any]:
+        """分解済みトークンの署名とクレームを検証し、クレームを返す。"""
+        if self.kind == "inline":
+            return verify_token(parsed, key, issuer=issuer, allowed_algorithms=allowed_algorithms)
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        if self.kind == "process":
+            # プロセス間で渡すのは署名検証に必要なバイト列だけにし、クレームの検証は手元で行う
+            key.check_algorithm(parsed, allowed_algorithms)
+            ok = await loop.run_in_executor(
+                executor, _verify_with_pem, key.alg, self._pem(key.key), parsed.signing_input, parsed.signature
+            )
+            if not ok:
+                raise InvalidSignatureError("Signature verification failed")
+            validate_claims(parsed.claims, issuer=issuer)
+            return parsed.claims
+        return await loop.run_in_executor(
+            executor,
+            functools.partial(verify_token, parsed, key, issuer=issuer, allowed_algorithms=allowed_algorithms),
+        )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,117 @@
+import posixpath
+import re
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from policies import RolePolicy
+from principal import Principal
+
+
+class PathRules:
+    """
+    外部認可（Envoy ext_authz / NGINX auth_request）で使う、パス接頭辞ごとのロール要件。
+
+    EXT_AUTHZ_RULES の形式: "<接頭辞>=<ロール>,<ロール>;<接頭辞>=<ロール>"
+      例: "/admin=app:owner;/reports=app:reader,app:viewer"
+    - ロールは client_id のクライアントロールとして「すべて」要求する
+    - 最も長く一致した接頭辞のルールを使う。どれにも一致しなければ認証だけで許可する
+    - 接頭辞はパスのセグメント単位で照合する（"/admin" は "/admin" と "/admin/..." に一致し、"/administrator" には一致しない）
+    - 照合するパスは original_path で正規化しておくこと
+    """
+
+    def __init__(self, rules: Mapping[str, RolePolicy]):
+        # 長い接頭辞から順に照合する
+        self._rules: Tuple[Tuple[str, RolePolicy], ...] = tuple(
+            sorted(rules.items(), key=lambda item: len(item[0]), reverse=True)
+        )
+
+    @classmethod
+    def parse(cls, spec: str, client_id: str) -> "PathRules":
+        rules: Dict[str, RolePolicy] = {}
+        for entry in spec.split(";"):
+            if not entry.strip():
+                continue
+            prefix, sep, roles = entry.partition("=")
+            names = [r.strip() for r in roles.split(",") if r.strip()]
+            prefix = prefix.strip()
+            if not sep or not prefix.startswith("/") or not names or original_path(prefix) is None:
+                raise ValueError(f"invalid EXT_AUTHZ_RULES entry: {entry!r}")
+            # ルール側も同じ正規化をかけ、末尾の / は付けない形にそろえる
+            rules[original_path(prefix).rstrip("/") or "/"] = RolePolicy(client={client_id: names}, mode="all")
+        return cls(rules)
+
+    def policy_for(self, path: str) -> Optional[RolePolicy]:
+        for prefix, policy in self._rules:
+            if prefix == "/" or path == prefix or path.startswith(prefix + "/"):
+                return policy
+        return None
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+
+# デコード後もパーセントエスケープが残る（二重エンコード）パスは正規化できないものとして扱う
+_PERCENT_ESCAPE = re.compile(r"%[0-9A-Fa-f]{2}")
+
+
+def original_path(path: str) -> Optional[str]:
+    """
+    ゲートウェイから受け取った元のパスを、ルールと照合できる正規形にする。
+
+    クエリ文字列を除いてパーセントデコードし、連続する / をまとめ、. と .. を解決する（末尾の / は残す）。
+    "//admin"、"/%61dmin"、"/./admin"、"/x/../admin" はすべて "/admin" になる。
+    二重エンコード・バックスラッシュ・制御文字・不正な UTF-8 を含むなど正規化できなければ None。
+    """
+    path = path.split("?", 1)[0].split("#", 1)[0]
+    try:
+        decoded = unquote(path, errors="strict")
+    except UnicodeDecodeError:
+        return None
+    if _PERCENT_ESCAPE.search(decoded) or "\\" in decoded or any(ord(c) < 0x20 or ord(c) == 0x7F for c in decoded):
+        return None
+    collapsed = re.sub(r"/+", "/", "/" + decoded)
+    normalized = posixpath.normpath(collapsed)
+    if collapsed.endswith("/") and normalized != "/":
+        normalized += "/"
+    return normalized
+
+
+def _header_value(value: Any) -> str:
+    # ヘッダは latin-1 しか載せられないので、ASCII 以外や改行はパーセントエンコードする
+    text = str(value)
+    if text.isascii() and text.isprintable():
+        return text
+    return quote(text, safe=" !#$%&'()*+,-./:;<=>?@[]^_`{|}~")
+
+
+def identity_headers(principal: Principal, client_id: str, prefix: str = "x-auth-") -> Dict[str, str]:
+    """上流サービスへ渡す最小限の本人情報ヘッダ（sub / ユーザー名 / クライアントロール）。"""
+    headers = {}
+    if principal.sub is not None:
+        headers[prefix + "sub"] = _header_value(principal.sub)
+    if principal.username is not None:
+        headers[prefix + "username"] = _header_value(principal.username)
+    client_roles = principal.client_roles(client_id)
+    if client_roles:
+        headers[prefix + "roles"] = _header_value(",".join(sorted(client_roles)))
+    return headers
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Authorization ヘッダから Bearer トークンを取り出す（無ければ None）。"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def batch_result(status_code: int, principal: Optional[Principal], reason: Optional[str]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"allow": status_code == 200, "status": status_code}
+    if principal is not None:
+        result["sub"] = principal.sub
+    if reason is not None:
+        result["reason"] = reason
+    return result
+
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from jwt import InvalidTokenError, PyJWTError
+
+from token_cache import NegativeCache, VerifiedTokenCache, token_digest
+
+
+class TokenInactiveError(InvalidTokenError):
+    """イントロスペクションで active=false（ログアウト済み・失効済みなど）と判定されたトークン。"""
+
+
+class IntrospectionUnavailableError(PyJWTError):
+    """イントロスペクションエンドポイントに問い合わせできない場合の例外。"""
+
+
+class TokenIntrospector:
+    """
+    Keycloak のトークンイントロスペクション（RFC 7662）をキャッシュ付きで呼び出すクライアント。
+
+    - active=true の結果は positive_ttl 秒（かつトークンの exp まで）キャッシュする
+    - active=false の結果は negative_ttl 秒キャッシュし、その間は問い合わせずに拒否する
+    - 同じトークンへの同時の問い合わせは 1 回にまとめる（single-flight）
+    - 接続は httpx.AsyncClient のプールで使い回す（keep-alive）
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: Optional[str] = None,
+        timeout: float = 5.0,
+        max_connections: int = 20,
+        positive_ttl: float = 30.0,
+        negative_ttl: float = 300.0,
+        max_size: int = 10000,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._active = VerifiedTokenCache(max_size=max_size, ttl_seconds=positive_ttl)
+        self._inactive = NegativeCache(max_size=max_size, ttl_seconds=negative_ttl)
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self.requests = 0
+
+    async def _post(self, endpoint: str, token: str) -> Dict[str, Any]:
+        data = {"token": token, "token_type_hint": "access_token"}
+        auth = None
+        if self.client_secret:
+            auth = (self.client_id, self.client_secret)
+        else:
+            data["client_id"] = self.client_id
+        self.requests += 1
+        try:
+            r = await self._client.post(endpoint, data=data, auth=auth)
+            r.raise_for_status()
+            result = r.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise IntrospectionUnavailableError(f"Introspection failed: {e}") from e
+        if not isinstance(result, dict):
+            raise IntrospectionUnavailableError("Introspection failed: response is not a JSON object")
+        return result
+
+    async def introspect(self, endpoint: str, token: str) -> Dict[str, Any]:
+        """
+        トークンが有効（active=true）ならイントロスペクション結果を返す。
+
+        Raises:
+            TokenInactiveError: active=false の場合
+            IntrospectionUnavailableError: エンドポイントに問い合わせできない場合
+        """
+        cached = self._active.get(token)
+        if cached is not None:
+            return cached
+        digest = token_digest(token)
+        if self._inactive.get(digest) is not None:
+            raise TokenInactiveError("Token is not active")
+
+        future = self._inflight.get(digest)
+        if future is not None:
+            # 同じトークンを問い合わせ中なら、その結果を待つ
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = future
+        try:
+            result = await self._post(endpoint, token)
+            if not result.get("active"):
+                self._inactive.add(digest, "inactive")
+                raise TokenInactiveError("Token is not active")
+            # exp が無い応答はキャッシュされない（VerifiedTokenCache の仕様）
+            self._active.put(token, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # 問い合わせた側（最初のリクエスト）が切断されても、相乗りしていた他のリクエストは
+            # キャンセル扱いにせず「問い合わせできなかった」として 503 にする
+            future.set_exception(IntrospectionUnavailableError("Introspection was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている側がいなくても「例外が取り出されなかった」警告を出さないようにする
+            future.exception()
+            raise
+        finally:
+            del self._inflight[digest]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "active": self._active.stats(),
+            "inactive": self._inactive.stats(),
+            "inflight": len(self._inflight),
+        }
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+def token_age(issued_at: Optional[float], now: Optional[float] = None) -> float:
+    """iat からの経過秒数。iat が無ければ無限大（＝常に古いトークン扱い）。"""
+    if issued_at is None:
+        return float("inf")
+    return (time.time() if now is None else now) - issued_at
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from jwt import InvalidTokenError
+
+from jwks_manager import JwksKeyManager
+
+
+class UnknownIssuerError(InvalidTokenError):
+    """許可リストにない発行者（iss）のトークン。外部への取得は一切行わない。"""
+
+
+class IssuerRegistry:
+    """
+    許可された発行者（Realm）ごとの JwksKeyManager を管理するレジストリ。
+
+    - 発行者ごとの鍵マネージャは最初に使われたときに作成・ウォームアップする
+    - 同時に保持するのは max_active 件まで。超えたら最も使われていないものから停止・破棄する
+    - idle_ttl 秒使われていないマネージャも、次の参照時に破棄する
+    - 許可リストにない iss は UnknownIssuerError で即座に拒否する
+    """
+
+    def __init__(
+        self,
+        allowed_issuers: Iterable[str],
+        manager_factory: Callable[[str], JwksKeyManager],
+        max_active: int = 64,
+        idle_ttl: float = 3600.0,
+    ):
+        self.allowed_issuers = frozenset(i.rstrip("/") for i in allowed_issuers)
+        self.manager_factory = manager_factory
+        self.max_active = max_active
+        self.idle_ttl = idle_ttl
+
+        # iss -> (鍵マネージャ, 最終利用時刻)
+        self._managers: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def jwks_url(issuer: str) -> str:
+        """Keycloak の Realm の発行者 URL から JWKS の URL を求める。"""
+        return f"{issuer}/protocol/openid-connect/certs"
+
+    @staticmethod
+    def discovery_url(issuer: str) -> str:
+        return f"{issuer}/.well-known/openid-configuration"
+
+    def _evict(self, now: float) -> list:
+        """ロック内で呼ぶ。破棄したマネージャを返す（停止はロック外で行う）。"""
+        evicted = []
+        while self._managers:
+            issuer, (manager, last_used) = next(iter(self._managers.items()))
+            if len(self._managers) <= self.max_active and now - last_used < self.idle_ttl:
+                break
+            del self._managers[issuer]
+            evicted.append(manager)
+        return evicted
+
+    def _lookup(self, issuer: str, create: bool):
+        """ロード済みのマネージャを返す（create=True なら無ければ作る）。"""
+        now = time.monotonic()
+        created = False
+        with self._lock:
+            entry = self._managers.get(issuer)
+            if entry is not None:
+                entry[1] = now
+                self._managers.move_to_end(issuer)
+                manager = entry[0]
+            elif create:
+                manager = self.manager_factory(issuer)
+                self._managers[issuer] = [manager, now]
+                created = True
+            else:
+                manager = None
+            evicted = self._evict(now)
+
+        for old in evicted:
+            old.stop(wait=False)
+        return manager, created
+
+    def _check_allowed(self, issuer: Optional[str]) -> None:
+        # iss はまだ検証前の値なので、文字列でなければ（リストなど）集合を引く前に拒否する
+        if not isinstance(issuer, str) or issuer not in self.allowed_issuers:
+            raise UnknownIssuerError(f"Issuer is not allowed: {issuer}")
+
+    def get(self, issuer: Optional[str]) -> JwksKeyManager:
+        """発行者の鍵マネージャを返す。未ロードなら作成してウォームアップする。"""
+        self._check_allowed(issuer)
+        manager, created = self._lookup(issuer, create=True)
+        if created:
+            # ウォームアップ中に来た他のリクエストは、鍵マネージャの single-flight で同じ取得を待つ
+            manager.start()
+        return manager
+
+    async def aget(self, issuer: Optional[str]) -> JwksKeyManager:
+        """get の非同期版。ロード済みならイベントループ上で返し、初回だけスレッドでウォームアップする。"""
+        self._check_allowed(issuer)
+        manager, _ = self._lookup(issuer, create=False)
+        if manager is not None:
+            return manager
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, issuer)
+
+    def stop(self) -> None:
+        with self._lock:
+            managers = [entry[0] for entry in self._managers.values()]
+            self._managers.clear()
+        for manager in managers:
+            manager.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = [(issuer, entry[0]) for issuer, entry in self._managers.items()]
+        return {
+            "allowed": len(self.allowed_issuers),
+            "active": len(items),
+            "max_active": self.max_active,
+            "issuers": {issuer: manager.stats() for issuer, manager in items},
+        }
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, Dict, Optional
+
+import jwt
+from jwt import PyJWKSet, InvalidTokenError, PyJWTError
+
+from jwks_snapshot import SnapshotStore
+from token_cache import NegativeCache
+from verifier import PreparedKey
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownKidError(InvalidTokenError):
+    """JWKS を取り直しても kid に対応する鍵が見つからない場合の例外。"""
+
+
+class JwksUnavailableError(PyJWTError):
+    """鍵セットを一度も取得できておらず、検証できない場合の例外。"""
+
+
+class JwksKeyManager:
+    """
+    Keycloak の JWKS を保持し、バックグラウンドで定期更新する鍵マネージャ。
+
+    - start() で起動時に鍵を取得（ウォームアップ）し、更新スレッドを開始する
+    - 未知の kid による取得は同時に何件来ても 1 回の fetch にまとめる（single-flight）
+    - 更新中や Keycloak の応答が遅い/失敗した場合も、最後に取得できた鍵セットを使い続ける
+    - kid ミスによる取り直しは min_refetch_interval 秒に 1 回までに制限し、
+      取り直しても見つからなかった kid は次に取り直せるようになるまで覚えておいて即座に拒否する
+    - discovery_url を指定すると、OIDC ディスカバリで jwks_uri を求めてから取得する
+    - snapshot を指定すると、取得した鍵セットをファイルに保存し、次回起動時はそこから即座に読み込む
+      （その後バックグラウンドで Keycloak と突き合わせる）
+    - 同じスナップショットのディレクトリを共有する別ワーカーが取得したばかりの鍵セットがあれば、
+      Keycloak へ取りに行かずにそれを取り込む（ワーカー数によらず取得回数を抑える）
+    """
+
+    def __init__(
+        self,
+        jwks_url: Optional[str] = None,
+        discovery_url: Optional[str] = None,
+        issuer: Optional[str] = None,
+        snapshot: Optional[SnapshotStore] = None,
+        refresh_interval: float = 300.0,
+        retry_interval: float = 10.0,
+        fetch_timeout: float = 5.0,
+        min_refetch_interval: float = 10.0,
+        unknown_kid_cache_size: int = 1024,
+        unknown_kid_ttl: float = 60.0,
+        on_fetch: Optional[Callable[[float, bool], None]] = None,
+    ):
+        if not jwks_url and not discovery_url:
+            raise ValueError("jwks_url or discovery_url is required")
+        self.jwks_url = jwks_url
+        self.discovery_url = discovery_url
+        self.issuer = issuer
+        self.snapshot = snapshot
+        self.metadata: Optional[Dict[str, Any]] = None
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.fetch_timeout = fetch_timeout
+        self.min_refetch_interval = min_refetch_interval
+        # 取得ごとに (所要秒数, 成功したか) で呼ばれるフック（メトリクス記録用）
+        self.on_fetch = on_fetch
+
+        # kid -> 検証用に準備済みの鍵。更新時は dict ごと差し替えるので、読み取りはロック不要
+        self._keys: Dict[str, PreparedKey] = {}
+        self._lock = threading.Lock()
+        self._inflight: Optional[threading.Event] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 未知 kid の記録は min_refetch_interval より長く残さない（ローテーション直後に
+        # 別の kid で取り直し枠を使われても、正規の新しい kid が長く拒否され続けないように）
+        self._unknown_kids = NegativeCache(unknown_kid_cache_size, min(unknown_kid_ttl, min_refetch_interval))
+        self._last_miss_fetch = float("-inf")
+        self._saved_jwks: Optional[Dict[str, Any]] = None
+        self._reconcile_on_start = False
+
+        self.last_refresh_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.fetch_count = 0
+
+    # ====== 取得 ======
+    @property
+    def snapshot_key(self) -> str:
+        return self.issuer or self.discovery_url or self.jwks_url
+
+    def _fetch_json(self, url: str) -> Dict[str, Any]:
+        with urllib.request.urlopen(url, timeout=self.fetch_timeout) as r:
+            return json.load(r)
+
+    @staticmethod
+    def _parse_keys(data: Dict[str, Any]) -> Dict[str, PreparedKey]:
+        jwk_set = PyJWKSet.from_dict(data)
+        return {
+            k.key_id: PreparedKey.from_jwk(k)
+            for k in jwk_set.keys
+            if k.key_id and k.public_key_use in (None, "sig")
+        }
+
+    def _discover(self) -> None:
+        metadata = self._fetch_json(self.discovery_url)
+        if self.issuer and metadata.get("issuer") != self.issuer:
+            raise ValueError(f"discovery issuer mismatch: {metadata.get('issuer')}")
+        if not metadata.get("jwks_uri"):
+            raise ValueError("discovery document has no jwks_uri")
+        self.metadata = metadata
+        self.jwks_url = metadata["jwks_uri"]
+
+    def _fetch_keys(self) -> Dict[str, PreparedKey]:
+        if self.discovery_url and (self.metadata is None or not self.jwks_url):
+            self._discover()
+        data = self._fetch_json(self.jwks_url)
+        keys = self._parse_keys(data)
+        self._save_snapshot(data)
+        return keys
+
+    # ====== スナップショット ======
+    def _save_snapshot(self, data: Dict[str, Any]) -> None:
+        if self.snapshot is None or data == self._saved_jwks:
+            return
+        try:
+            self.snapshot.save(self.snapshot_key, data, self.metadata)
+            self._saved_jwks = data
+        except OSError as e:
+            logger.warning("Failed to write JWKS snapshot: %s", e)
+
+    def load_snapshot(self) -> bool:
+        """
+        保存済みのスナップショットから鍵セットを読み込む。
+
+        Returns:
+            bool: 有効なスナップショットから鍵を読み込めたら True
+        """
+        if self.snapshot is None:
+            return False
+        snap = self.snapshot.load(self.snapshot_key)
+        if snap is None:
+            return False
+        return self._apply_snapshot(snap)
+
+    def adopt_snapshot(self, max_age: float) -> bool:
+        """
+        他のワーカーが max_age 秒以内に保存した、手元より新しいスナップショットがあれば取り込む。
+
+        Returns:
+            bool: 取り込んだら True
+        """
+        if self.snapshot is None:
+            return False
+        snap = self.snapshot.load(self.snapshot_key)
+        if snap is None:
+            return False
+        saved_at = snap["saved_at"]
+        if time.time() - saved_at > max_age:
+            return False
+        if self.last_refresh_at is not None and saved_at <= self.last_refresh_at:
+            return False
+        if not self._apply_snapshot(snap):
+            return False
+        self._unknown_kids.clear()
+        self.last_error = None
+        return True
+
+    def _apply_snapshot(self, snap: Dict[str, Any]) -> bool:
+        try:
+            keys = self._parse_keys(snap["jwks"])
+        except PyJWTError as e:
+            logger.warning("Ignoring JWKS snapshot with unusable keys: %s", e)
+            return False
+
+        discovery = snap.get("discovery")
+        if isinstance(discovery, dict) and discovery.get("jwks_uri"):
+            if not self.issuer or discovery.get("issuer") == self.issuer:
+                self.metadata = discovery
+                self.jwks_url = discovery["jwks_uri"]
+        self._keys = keys
+        self._saved_jwks = snap["jwks"]
+        self.last_refresh_at = snap["saved_at"]
+        return True
+
+    def refresh(self) -> bool:
+        """
+        JWKS を取り直す。別スレッドが取得中ならその完了を待つだけにする。
+
+        Returns:
+            bool: 鍵セットが 1 つ以上利用可能なら True
+        """
+        with self._lock:
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+
+        if not leader:
+            event.wait(self.fetch_timeout)
+            return bool(self._keys)
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            self.fetch_count += 1
+            keys = self._fetch_keys()
+            self._keys = keys
+            # 新しい鍵セットで見つかる可能性があるので、未知 kid の記録は捨てる
+            self._unknown_kids.clear()
+            self.last_refresh_at = time.time()
+            self.last_error = None
+            ok = True
+        except Exception as e:
+            # 失敗しても直前の鍵セットは維持する（stale-while-revalidate）
+            self.last_error = str(e)
+            logger.warning("JWKS refresh failed (%s): %s", self.jwks_url or self.discovery_url, e)
+        finally:
+            with self._lock:
+                self._inflight = None
+            event.set()
+            if self.on_fetch is not None:
+                self.on_fetch(time.perf_counter() - started, ok)
+        return bool(self._keys)
+
+    # ====== 参照 ======
+    def get_signing_key(self, kid: Optional[str]) -> PreparedKey:
+        """
+        kid に対応する鍵を返す。未知の kid なら（レート制限の範囲内で）1 回だけ取り直す。
+        """
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        if self._unknown_kids.get(kid) is not None:
+            raise UnknownKidError(f'Unable to find a signing key that matches: "{kid}"')
+
+        now = time.monotonic()
+        refetched = now - self._last_miss_fetch >= self.min_refetch_interval
+        if refetched:
+            self._last_miss_fetch = now
+            # 別ワーカーが新しい鍵セットを保存済みなら、それで足りるか先に確かめる
+            if not (self.adopt_snapshot(self.refresh_interval) and kid in self._keys):
+                self.refresh()
+        else:
+            # 制限中でも、他のスレッドが取り直している最中ならその結果は待つ
+            event = self._inflight
+            if event is not None:
+                event.wait(self.fetch_timeout)
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        if not self._keys:
+            raise JwksUnavailableError(f"JWKS is not available: {self.last_error}")
+        if refetched:
+            # 取り直しても無かった kid だけを記録する（制限中で取り直せなかった kid は覚えない）
+            self._unknown_kids.add(kid)
+        raise UnknownKidError(f'Unable to find a signing key that matches: "{kid}"')
+
+    async def aget_signing_key(self, kid: Optional[str]) -> PreparedKey:
+        """
+        get_signing_key の非同期版。
+        手元の鍵や未知 kid の記録で決まる場合はイベントループ上で即座に返し、
+        JWKS の取り直しが必要なときだけスレッドで待つ。
+        """
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        if self._unknown_kids.get(kid) is not None:
+            raise UnknownKidError(f'Unable to find a signing key that matches: "{kid}"')
+        # 制限中で取り直し中でもなければ、スレッドに回しても結果は変わらない
+        throttled = time.monotonic() - self._last_miss_fetch < self.min_refetch_interval
+        if throttled and self._inflight is None:
+            if not self._keys:
+                raise JwksUnavailableError(f"JWKS is not available: {self.last_error}")
+            raise UnknownKidError(f'Unable to find a signing key that matches: "{kid}"')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_signing_key, kid)
+
+    def get_signing_key_from_jwt(self, token: str) -> PreparedKey:
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "fetch_count": self.fetch_count,
+            "last_refresh_at": self.last_refresh_at,
+            "last_error": self.last_error,
+            "unknown_kids": self._unknown_kids.stats(),
+        }
+
+    # ====== バックグラウンド更新 ======
+    def _run(self) -> None:
+        if self._reconcile_on_start:
+            # スナップショットから起動した場合は、すぐに Keycloak の最新状態と突き合わせる
+            self._reconcile_on_start = False
+            if time.time() - self.last_refresh_at > self.min_refetch_interval:
+                self.refresh()
+        while True:
+            interval = self.refresh_interval if self.last_error is None else self.retry_interval
+            if self._stop.wait(interval):
+                return
+            if not self.adopt_snapshot(self.refresh_interval / 2):
+                self.refresh()
+
+    def start(self) -> None:
+        """
+        鍵をウォームアップし、定期更新スレッドを開始する。
+        有効なスナップショットがあればそれを使い、Keycloak への取得はバックグラウンドで行う。
+        """
+        if self._thread is not None:
+            return
+        if self.load_snapshot():
+            self._reconcile_on_start = True
+        else:
+            self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="jwks-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            if wait:
+                self._thread.join(timeout=self.fetch_timeout)
+            self._thread = None
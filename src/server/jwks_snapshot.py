@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """
+    OIDC ディスカバリ情報と最後に取得できた JWKS をローカルファイルに保存するストア。
+
+    起動直後や Keycloak 停止中でも、保存済みの鍵ですぐに検証を始められるようにする。
+    - 書き込みは一時ファイル + rename で行い、途中で落ちても壊れたファイルを残さない
+    - 読み込み時は形式・発行者・保存時刻を確認し、壊れたものや max_age を超えた古いものは使わない
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: str, max_age: float = 86400.0):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"jwks-{name}.json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        保存済みのスナップショットを返す。無い/壊れている/古い場合は None。
+
+        Returns:
+            dict: {"key", "saved_at", "jwks", "discovery"}
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable JWKS snapshot %s: %s", path, e)
+            return None
+
+        try:
+            valid = (
+                snapshot["version"] == self.VERSION
+                and snapshot["key"] == key
+                and isinstance(snapshot["jwks"].get("keys"), list)
+                and isinstance(snapshot["saved_at"], (int, float))
+            )
+        except (KeyError, TypeError, AttributeError):
+            valid = False
+        if not valid:
+            logger.warning("Ignoring malformed JWKS snapshot %s", path)
+            return None
+
+        age = time.time() - snapshot["saved_at"]
+        if not 0 <= age <= self.max_age:
+            logger.info("Ignoring stale JWKS snapshot %s (age %.0fs)", path, age)
+            return None
+        return snapshot
+
+    def save(self, key: str, jwks: Dict[str, Any], discovery: Optional[Dict[str, Any]] = None) -> None:
+        snapshot = {
+            "version": self.VERSION,
+            "key": key,
+            "saved_at": time.time(),
+            "jwks": jwks,
+            "discovery": discovery,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".jwks-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,213 @@
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 記録はロックを取らない（イベントループ上での更新が中心のため）。
+# 別スレッドと同時に更新した場合に稀に 1 件取りこぼしても、計測用途としては許容する。
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+_INF = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, v in list(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # ラベル値 -> [バケットごとの件数..., +Inf の件数, 合計値]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series.setdefault(labelvalues, [0] * (len(self.buckets) + 2))
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, _INF)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class GaugeFunc:
+    """描画時にコールバックで値を取得するゲージ（キャッシュの統計値などを出すため）。"""
+
+    def __init__(self, name: str, help: str, func: Callable[[], Optional[float]]):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self) -> List[str]:
+        value = self.func()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, help, labelnames, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_func(self, name: str, help: str, func: Callable[[], Optional[float]]) -> GaugeFunc:
+        metric = GaugeFunc(name, help, func)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus テキスト形式で全メトリクスを出力する。"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# ====== Server-Timing ======
+# リクエストごとのフェーズ計測（名前, 秒）。ミドルウェアがリクエスト開始時にリストを用意する
+_server_timing: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timing", default=None)
+
+
+def record_timing(name: str, seconds: float) -> None:
+    """現在のリクエストの Server-Timing にフェーズを追加する（リクエスト外なら何もしない）。"""
+    timings = _server_timing.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+# ====== リクエスト ID ======
+# クライアントが送った X-Request-ID（なければ生成した値）。レスポンスにも同じ値を返す
+REQUEST_ID_HEADER = b"x-request-id"
+_MAX_REQUEST_ID_LENGTH = 128
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    """処理中のリクエストの ID（リクエスト外なら None）。"""
+    return _request_id.get()
+
+
+def _accept_request_id(value: Optional[bytes]) -> str:
+    """受け取った ID が 128 文字以内の表示可能な ASCII ならそのまま使い、そうでなければ作り直す。"""
+    if value and len(value) <= _MAX_REQUEST_ID_LENGTH and all(0x21 <= c <= 0x7E for c in value):
+        return value.decode("ascii")
+    return uuid.uuid4().hex
+
+
+class MetricsMiddleware:
+    """
+    ルートごとのリクエスト時間を記録し、Server-Timing ヘッダを付ける ASGI ミドルウェア。
+    BaseHTTPMiddleware を使わず、send をラップするだけにしてオーバーヘッドを抑える。
+
+    X-Request-ID を引き継いで（なければ生成して）レスポンスに返し、
+    on_timing を渡すとリクエストごとに (request_id, method, route, status, phases) で呼ぶ。
+    phases は Server-Timing と同じ [(名前, 秒), ...]（最後が total）。
+    """
+
+    def __init__(
+        self,
+        app,
+        histogram: Histogram,
+        server_timing: bool = True,
+        on_timing: Optional[Callable[[str, str, str, int, List[Tuple[str, float]]], None]] = None,
+    ):
+        self.app = app
+        self.histogram = histogram
+        self.server_timing = server_timing
+        self.on_timing = on_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        timings: List[Tuple[str, float]] = []
+        token = _server_timing.set(timings)
+        request_id = _accept_request_id(
+            next((v for k, v in scope.get("headers", ()) if k == REQUEST_ID_HEADER), None)
+        )
+        id_token = _request_id.set(request_id)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = [*message.get("headers", ()), (REQUEST_ID_HEADER, request_id.encode())]
+                if self.server_timing:
+                    phases = [*timings, ("total", time.perf_counter() - start)]
+                    value = ", ".join(f"{name};dur={sec * 1000:.3f}" for name, sec in phases)
+                    headers.append((b"server-timing", value.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _server_timing.reset(token)
+            _request_id.reset(id_token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            # ラベルの種類が増えすぎないよう、実パスではなくルートのパステンプレートを使う
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(elapsed, scope["method"], path, str(status_code))
+            if self.on_timing is not None:
+                self.on_timing(request_id, scope["method"], path, status_code, [*timings, ("total", elapsed)])
@@ -0,0 +1,86 @@
+from typing import Any, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
+
+_EMPTY: FrozenSet[str] = frozenset()
+
+
+class RoleSet:
+    """
+    検証済みトークンから取り出した呼び出し元のロール。
+    realm_access / resource_access を 1 回だけ走査して frozenset にしておく。
+    """
+
+    __slots__ = ("realm", "client")
+
+    def __init__(self, realm: FrozenSet[str], client: Dict[str, FrozenSet[str]]):
+        self.realm = realm
+        self.client = client
+
+    @classmethod
+    def from_claims(cls, claims: Mapping[str, Any]) -> "RoleSet":
+        realm = frozenset((claims.get("realm_access") or {}).get("roles") or ())
+        client = {
+            client_id: frozenset((access or {}).get("roles") or ())
+            for client_id, access in (claims.get("resource_access") or {}).items()
+        }
+        return cls(realm, client)
+
+    def client_roles(self, client_id: str) -> FrozenSet[str]:
+        return self.client.get(client_id, _EMPTY)
+
+
+class RolePolicy:
+    """
+    ルートごとのロール要件。生成時に frozenset へコンパイルし、判定は集合演算だけで行う。
+
+    - mode="all": 指定したロールをすべて持っていれば許可
+    - mode="any": 指定したロールのどれか 1 つを持っていれば許可
+    """
+
+    __slots__ = ("mode", "realm", "client")
+
+    def __init__(
+        self,
+        realm: Iterable[str] = (),
+        client: Optional[Mapping[str, Iterable[str]]] = None,
+        mode: str = "all",
+    ):
+        if mode not in ("all", "any"):
+            raise ValueError(f"unknown policy mode: {mode}")
+        self.mode = mode
+        self.realm: FrozenSet[str] = frozenset(realm)
+        self.client: Tuple[Tuple[str, FrozenSet[str]], ...] = tuple(
+            (client_id, frozenset(roles))
+            for client_id, roles in (client or {}).items()
+            if roles
+        )
+        if not self.realm and not self.client:
+            raise ValueError("policy requires at least one role")
+
+    def allows(self, roles: RoleSet) -> bool:
+        if self.mode == "all":
+            if not self.realm <= roles.realm:
+                return False
+            for client_id, required in self.client:
+                if not required <= roles.client_roles(client_id):
+                    return False
+            return True
+
+        if not self.realm.isdisjoint(roles.realm):
+            return True
+        for client_id, required in self.client:
+            if not required.isdisjoint(roles.client_roles(client_id)):
+                return True
+        return False
+
+    def missing(self, roles: RoleSet) -> str:
+        """拒否理由に使う、不足しているロールの表記（realm ロールはそのまま、client ロールは名前のみ）。"""
+        if self.mode == "all":
+            names = sorted(self.realm - roles.realm)
+            for client_id, required in self.client:
+                names += sorted(required - roles.client_roles(client_id))
+            return ", ".join(names)
+
+        names = sorted(self.realm)
+        for _, required in self.client:
+            names += sorted(required)
+        return "any of " + ", ".join(names)
@@ -0,0 +1,82 @@
+import json
+from typing import Any, Dict, FrozenSet, Mapping, Optional, Tuple
+
+from jwt.utils import base64url_decode
+
+from policies import RoleSet
+
+
+class Principal:
+    """
+    検証済みトークンの呼び出し元。ルートが使う項目だけを検証時に 1 回だけ取り出して保持する。
+
+    - scope とロールは frozenset にしておき、判定は集合演算だけで行う
+    - レスポンスにそのまま返す scope の文字列と realm ロールの並びは、トークンの値を変えずに保持する
+    - 元のクレーム全体は保持せず、必要になったとき（claims）にペイロード部分からデコードする
+      （キャッシュに載せても 1 件あたりのメモリが小さく済む。署名部分は持たないのでトークンとしては使えない）
+    """
+
+    __slots__ = (
+        "sub", "username", "client", "issuer", "issued_at", "expires_at",
+        "scope", "scopes", "realm_roles", "roles", "_payload",
+    )
+
+    def __init__(
+        self,
+        sub: Optional[str],
+        username: Optional[str],
+        client: Optional[str],
+        issuer: Optional[str],
+        issued_at: Optional[float],
+        expires_at: Optional[float],
+        scope: Optional[str],
+        realm_roles: Optional[Tuple[str, ...]],
+        roles: RoleSet,
+        payload: Optional[str] = None,
+    ):
+        self.sub = sub
+        self.username = username
+        self.client = client
+        self.issuer = issuer
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+        # scope: トークンの scope 文字列そのもの / scopes: 判定用の集合
+        self.scope = scope
+        self.scopes: FrozenSet[str] = frozenset(scope.split()) if scope else frozenset()
+        # realm_access.roles の並びそのもの（realm_access が無ければ None）。判定には roles.realm を使う
+        self.realm_roles = realm_roles
+        self.roles = roles
+        self._payload = payload
+
+    @classmethod
+    def from_claims(cls, claims: Mapping[str, Any], token: Optional[str] = None) -> "Principal":
+        """検証済みクレーム（と元のトークン）から作る。token を渡すと claims で元のクレームを取り出せる。"""
+        iat = claims.get("iat")
+        exp = claims.get("exp")
+        scope = claims.get("scope")
+        realm_roles = (claims.get("realm_access") or {}).get("roles")
+        return cls(
+            sub=claims.get("sub"),
+            username=claims.get("preferred_username"),
+            client=claims.get("azp"),
+            issuer=claims.get("iss"),
+            issued_at=iat if isinstance(iat, (int, float)) else None,
+            expires_at=exp if isinstance(exp, (int, float)) else None,
+            scope=scope if isinstance(scope, str) else None,
+            realm_roles=tuple(realm_roles) if isinstance(realm_roles, list) else None,
+            roles=RoleSet.from_claims(claims),
+            payload=token.split(".", 2)[1] if token else None,
+        )
+
+    def client_roles(self, client_id: str) -> FrozenSet[str]:
+        return self.roles.client_roles(client_id)
+
+    def has_client_role(self, client_id: str, role: str) -> bool:
+        return role in self.roles.client_roles(client_id)
+
+    @property
+    def claims(self) -> Dict[str, Any]:
+        """元のクレーム全体（呼ぶたびにデコードする。トークン無しで作った場合は空）。"""
+        if self._payload is None:
+            return {}
+        return json.loads(base64url_decode(self._payload))
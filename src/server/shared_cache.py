@@ -0,0 +1,180 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+# ファイル先頭のヘッダ: magic, version, スロット数, スロットサイズ
+_HEADER = struct.Struct("<8sIII")
+_MAGIC = b"KCAUTHC\x00"
+_VERSION = 1
+_HEADER_SIZE = 64
+
+# スロット: seq(奇数なら書き込み中), digest(32B), 期限(UNIX 時刻), ペイロード長, CRC32, ペイロード
+_SLOT = struct.Struct("<I32sdHI")
+# ペイロード長のフィールド（H）で表せる最大値
+_MAX_PAYLOAD = 0xFFFF
+
+# 共有キャッシュに載せるクレーム（ルートが使うものだけに絞ってスロットに収める）
+COMPACT_CLAIMS = (
+    "iss", "sub", "exp", "iat", "azp", "typ", "sid",
+    "preferred_username", "scope", "realm_access", "resource_access",
+)
+
+
+def compact_claims(claims: Dict[str, Any], keys: Iterable[str] = COMPACT_CLAIMS) -> Dict[str, Any]:
+    return {k: claims[k] for k in keys if k in claims}
+
+
+class SharedTokenCache:
+    """
+    同一ホストの全ワーカープロセスで共有する、検証済みトークンのキャッシュ。
+
+    メモリマップしたファイル（/dev/shm 上を推奨）を固定長スロットのハッシュテーブルとして使う。
+    - 読み取りはロックを取らない。スロットごとのシーケンス番号（seqlock）と CRC で、
+      書き込み途中のデータを読んだ場合はミス扱いにする
+    - 書き込みは flock でプロセス間排他する（ミス時のみなので頻度は低い）
+    - キーはトークンのダイジェスト、値は COMPACT_CLAIMS に絞ったクレームの JSON
+    - 既存ファイルのスロット数・サイズが設定と違う場合は、その場で作り直さず新しいファイルに置き換える
+      （古い設定のワーカーは置き換え前のファイルをマップしたまま使い続けられる）
+    """
+
+    PROBES = 4
+
+    def __init__(self, path: str, slots: int = 4096, slot_size: int = 1024, ttl_seconds: float = 300.0):
+        if slots <= 0 or slot_size <= _SLOT.size:
+            raise ValueError("slots must be positive and slot_size must exceed the slot header")
+        if slot_size - _SLOT.size > _MAX_PAYLOAD:
+            raise ValueError(f"slot_size must be at most {_SLOT.size + _MAX_PAYLOAD}")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_payload = slot_size - _SLOT.size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        size = _HEADER_SIZE + slots * slot_size
+        expected = _HEADER.pack(_MAGIC, _VERSION, slots, slot_size)
+        self._fd = self._open_locked()
+        try:
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                # 初回作成（ロックを持っているので、まだ誰もマップしていない）
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, expected, 0)
+            elif current != size or os.pread(self._fd, _HEADER.size, 0) != expected:
+                # 設定の異なるファイル。他のワーカーがマップしている可能性があるので、
+                # 切り詰めたり上書きしたりせず（SIGBUS や破損の原因になる）新しいファイルに置き換える
+                self._fd = self._replace_locked(self._fd, size, expected)
+            self._mm = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _open_locked(self) -> int:
+        """path を開いて排他ロックを取る。ロック待ちの間に別ワーカーが置き換えていたら開き直す。"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _replace_locked(self, old_fd: int, size: int, header: bytes) -> int:
+        """初期化した新しいファイルを path に置き換え、ロックを取った状態で返す。"""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, header, 0)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.close(fd)
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        os.close(old_fd)
+        return fd
+
+    def _offsets(self, digest: bytes):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        for i in range(self.PROBES):
+            yield _HEADER_SIZE + ((start + i) % self.slots) * self.slot_size
+
+    def get(self, digest: bytes) -> Optional[Dict[str, Any]]:
+        mm = self._mm
+        for off in self._offsets(digest):
+            seq, slot_digest, expires_at, length, crc = _SLOT.unpack_from(mm, off)
+            if slot_digest != digest:
+                continue
+            if seq & 1 or length > self.max_payload:
+                break
+            data = mm[off + _SLOT.size: off + _SLOT.size + length]
+            if _SLOT.unpack_from(mm, off)[0] != seq or zlib.crc32(data) != crc:
+                break
+            if expires_at <= time.time():
+                break
+            self.hits += 1
+            return json.loads(data)
+        self.misses += 1
+        return None
+
+    def put(self, digest: bytes, claims: Dict[str, Any]) -> bool:
+        """
+        検証済みクレームを登録する。有効期限は exp と現在時刻 + ttl の早い方。
+        exp が無い、またはスロットに収まらない大きさなら登録せず False を返す。
+        """
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return False
+        expires_at = min(float(exp), time.time() + self.ttl_seconds)
+        data = json.dumps(compact_claims(claims), separators=(",", ":")).encode()
+        if len(data) > self.max_payload:
+            return False
+
+        mm = self._mm
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # 同じ digest > 空き/期限切れ > 最も早く期限が来るもの、の順で書き込み先を選ぶ
+            now = time.time()
+            target = None
+            target_expiry = float("inf")
+            for off in self._offsets(digest):
+                _, slot_digest, slot_expiry, _, _ = _SLOT.unpack_from(mm, off)
+                if slot_digest == digest or slot_expiry <= now:
+                    target = off
+                    break
+                if slot_expiry < target_expiry:
+                    target, target_expiry = off, slot_expiry
+
+            seq = _SLOT.unpack_from(mm, target)[0]
+            struct.pack_into("<I", mm, target, (seq + 1) | 1)
+            mm[target + _SLOT.size: target + _SLOT.size + len(data)] = data
+            _SLOT.pack_into(
+                mm, target, (seq + 1) | 1, digest, expires_at, len(data), zlib.crc32(data)
+            )
+            struct.pack_into("<I", mm, target, ((seq + 1) | 1) + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
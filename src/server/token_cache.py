@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+from principal import Principal
+
+
+def token_digest(token: str) -> bytes:
+    """トークン文字列をキャッシュキー用の SHA-256 ダイジェストに変換する。"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """
+    署名検証済みトークンの呼び出し元（Principal）またはクレームを保持する LRU キャッシュ。
+
+    - キーはトークンのダイジェスト（生トークンは保持しない）
+    - エントリの有効期限は「トークンの exp」と「現在時刻 + ttl」の早い方
+    - max_size を超えたら最も古く使われたエントリから追い出す
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300.0):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[float, Union[Principal, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Union[Principal, Dict[str, Any]]]:
+        """有効なエントリがあれば登録した値を返す。無い/期限切れなら None。"""
+        key = token_digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, claims = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, value: Union[Principal, Dict[str, Any]]) -> None:
+        """検証済みの Principal またはクレームを登録する。exp が無いトークンはキャッシュしない。"""
+        exp = value.expires_at if isinstance(value, Principal) else value.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        expires_at = min(float(exp), time.time() + self.ttl_seconds)
+        key = token_digest(token)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット/ミス回数と現在のエントリ数を返す。"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class NegativeCache:
+    """
+    最近拒否したキー（トークンのダイジェストや未知の kid）を TTL 付きで保持する有界キャッシュ。
+
+    不正トークンが大量に来ても、2 回目以降は dict 参照だけで拒否できるようにする。
+    参照はロックを取らず、追加/削除のみロックで保護する。
+    """
+
+    def __init__(self, max_size: int = 4096, ttl_seconds: float = 60.0):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """拒否済みなら拒否理由を返す。未登録/期限切れなら None。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, reason = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        self.hits += 1
+        return reason
+
+    def add(self, key: Hashable, reason: str = "") -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, reason)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+        }
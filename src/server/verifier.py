@@ -0,0 +1,160 @@
+import binascii
+import json
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from jwt import PyJWK
+from jwt.exceptions import (
+    DecodeError,
+    ExpiredSignatureError,
+    ImmatureSignatureError,
+    InvalidAlgorithmError,
+    InvalidAudienceError,
+    InvalidIssuedAtError,
+    InvalidIssuerError,
+    InvalidSignatureError,
+    MissingRequiredClaimError,
+)
+from jwt.utils import base64url_decode
+
+# 受け付ける署名アルゴリズム（鍵ごとに 1 つに固定して検証する）
+SUPPORTED_ALGORITHMS: FrozenSet[str] = frozenset({"RS256", "PS256", "ES256", "EdDSA"})
+
+
+class ParsedToken:
+    """
+    JWT を 1 回だけ分解した結果。ヘッダ・クレーム・署名対象・署名を保持し、
+    鍵の選択と署名検証の両方でこれを使い回す（jwt.decode による再パースをしない）。
+    """
+
+    __slots__ = ("header", "claims", "signing_input", "signature")
+
+    def __init__(self, header: Dict[str, Any], claims: Dict[str, Any], signing_input: bytes, signature: bytes):
+        self.header = header
+        self.claims = claims
+        self.signing_input = signing_input
+        self.signature = signature
+
+    @property
+    def alg(self) -> Optional[str]:
+        return self.header.get("alg")
+
+    @property
+    def kid(self) -> Optional[str]:
+        return self.header.get("kid")
+
+
+def parse_token(token: str) -> ParsedToken:
+    """compact 形式の JWT を分解する。形式が不正なら DecodeError。"""
+    try:
+        data = token.encode("ascii")
+        signing_input, crypto_segment = data.rsplit(b".", 1)
+        header_segment, payload_segment = signing_input.split(b".", 1)
+    except (UnicodeEncodeError, ValueError) as e:
+        raise DecodeError("Not enough segments") from e
+    try:
+        header = json.loads(base64url_decode(header_segment))
+        claims = json.loads(base64url_decode(payload_segment))
+        signature = base64url_decode(crypto_segment)
+    except (binascii.Error, ValueError) as e:
+        raise DecodeError(f"Invalid token encoding: {e}") from e
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise DecodeError("Invalid token: header and payload must be JSON objects")
+    # kid / alg は鍵の選択に使うので、文字列以外（リストなど）はここで拒否する
+    if not isinstance(header.get("alg"), str):
+        raise DecodeError("Invalid header: alg must be a string")
+    if "kid" in header and not isinstance(header["kid"], str):
+        raise DecodeError("Invalid header: kid must be a string")
+    return ParsedToken(header, claims, signing_input, signature)
+
+
+class PreparedKey:
+    """
+    JWKS の 1 つの鍵から作った検証用の鍵。
+    cryptography の鍵オブジェクトとアルゴリズム実装を kid ごとに 1 回だけ作り、
+    そのアルゴリズム以外で署名されたトークンは受け付けない（alg の差し替え対策）。
+    """
+
+    __slots__ = ("key_id", "alg", "key", "algorithm")
+
+    def __init__(self, key_id: Optional[str], alg: str, key: Any, algorithm: Any):
+        self.key_id = key_id
+        self.alg = alg
+        self.key = key
+        self.algorithm = algorithm
+
+    @classmethod
+    def from_jwk(cls, jwk: PyJWK) -> "PreparedKey":
+        return cls(jwk.key_id, jwk.algorithm_name, jwk.key, jwk.Algorithm)
+
+    def check_algorithm(self, parsed: ParsedToken, allowed: Iterable[str] = SUPPORTED_ALGORITHMS) -> None:
+        alg = parsed.alg
+        if alg != self.alg:
+            raise InvalidAlgorithmError(f"Token alg {alg} does not match key alg {self.alg}")
+        if alg not in allowed:
+            raise InvalidAlgorithmError(f"The specified alg value is not allowed: {alg}")
+
+    def verify_signature(self, parsed: ParsedToken) -> None:
+        if not self.algorithm.verify(parsed.signing_input, self.key, parsed.signature):
+            raise InvalidSignatureError("Signature verification failed")
+
+
+def validate_claims(
+    claims: Dict[str, Any],
+    issuer: Optional[str] = None,
+    leeway: float = 0,
+    now: Optional[float] = None,
+    audience: Optional[str] = None,
+) -> None:
+    """exp / nbf / iat / iss を jwt.decode と同じ例外で検証する（aud は audience を渡したときだけ検証する）。"""
+    now = time.time() if now is None else now
+
+    iat = claims.get("iat")
+    if iat is not None:
+        if not isinstance(iat, (int, float)):
+            raise InvalidIssuedAtError("Issued At claim (iat) must be an integer.")
+        if iat > now + leeway:
+            raise ImmatureSignatureError("The token is not yet valid (iat)")
+
+    nbf = claims.get("nbf")
+    if nbf is not None:
+        if not isinstance(nbf, (int, float)):
+            raise DecodeError("Not Before claim (nbf) must be an integer.")
+        if nbf > now + leeway:
+            raise ImmatureSignatureError("The token is not yet valid (nbf)")
+
+    exp = claims.get("exp")
+    if exp is not None:
+        if not isinstance(exp, (int, float)):
+            raise DecodeError("Expiration Time claim (exp) must be an integer.")
+        if exp <= now - leeway:
+            raise ExpiredSignatureError("Signature has expired")
+
+    if issuer is not None and claims.get("iss") != issuer:
+        raise InvalidIssuerError("Invalid issuer")
+
+    if audience is not None:
+        aud = claims.get("aud")
+        if aud is None:
+            raise MissingRequiredClaimError("aud")
+        if isinstance(aud, str):
+            aud = [aud]
+        if not isinstance(aud, list) or not all(isinstance(a, str) for a in aud):
+            raise InvalidAudienceError("Invalid claim format in token")
+        if audience not in aud:
+            raise InvalidAudienceError("Audience doesn't match")
+
+
+def verify_token(
+    parsed: ParsedToken,
+    key: PreparedKey,
+    issuer: Optional[str] = None,
+    allowed_algorithms: Iterable[str] = SUPPORTED_ALGORITHMS,
+    leeway: float = 0,
+    audience: Optional[str] = None,
+) -> Dict[str, Any]:
+    """分解済みトークンを鍵で検証し、クレームを返す。"""
+    key.check_algorithm(parsed, allowed_algorithms)
+    key.verify_signature(parsed)
+    validate_claims(parsed.claims, issuer=issuer, leeway=leeway, audience=audience)
+    return parsed.claims
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/server のモジュールは app.py と同じくフラットに import する（from verifier import ...）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "server"))
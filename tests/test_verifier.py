@@ -0,0 +1,177 @@
+import base64
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jwt import PyJWK
+from jwt.algorithms import ECAlgorithm, RSAAlgorithm
+from jwt.exceptions import (
+    DecodeError,
+    ExpiredSignatureError,
+    ImmatureSignatureError,
+    InvalidAlgorithmError,
+    InvalidAudienceError,
+    InvalidIssuerError,
+    InvalidSignatureError,
+    MissingRequiredClaimError,
+)
+
+from verifier import PreparedKey, parse_token, verify_token
+
+ISSUER = "https://keycloak.example/realms/test-realm"
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+def _rsa_key(kid: str = "rsa-1"):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private_key, PreparedKey.from_jwk(PyJWK.from_dict(jwk))
+
+
+def _ec_key(kid: str = "ec-1"):
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = ECAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk.update({"kid": kid, "alg": "ES256", "use": "sig"})
+    return private_key, PreparedKey.from_jwk(PyJWK.from_dict(jwk))
+
+
+@pytest.fixture(scope="module")
+def rsa_key():
+    return _rsa_key()
+
+
+def _claims(**overrides):
+    now = int(time.time())
+    claims = {"iss": ISSUER, "sub": "user-1", "aud": ["backend-api", "account"], "iat": now, "exp": now + 300}
+    claims.update(overrides)
+    return {k: v for k, v in claims.items() if v is not None}
+
+
+def _token(private_key, alg="RS256", kid="rsa-1", **overrides) -> str:
+    return jwt.encode(_claims(**overrides), private_key, algorithm=alg, headers={"kid": kid})
+
+
+def test_valid_token(rsa_key):
+    private_key, key = rsa_key
+    claims = verify_token(parse_token(_token(private_key)), key, issuer=ISSUER)
+    assert claims["sub"] == "user-1"
+
+
+def test_alg_mismatch_is_rejected(rsa_key):
+    private_key, key = rsa_key
+    # 同じ RSA 鍵でも、鍵の alg（RS256）以外で署名されたトークンは受け付けない
+    token = _token(private_key, alg="PS256")
+    with pytest.raises(InvalidAlgorithmError):
+        verify_token(parse_token(token), key, issuer=ISSUER)
+
+
+def test_alg_header_swapped_to_hmac_is_rejected(rsa_key):
+    private_key, key = rsa_key
+    header, payload, signature = _token(private_key).split(".")
+    forged = ".".join([_b64({"alg": "HS256", "kid": "rsa-1"}), payload, signature])
+    with pytest.raises(InvalidAlgorithmError):
+        verify_token(parse_token(forged), key, issuer=ISSUER)
+
+
+def test_alg_not_allowed(rsa_key):
+    private_key, key = rsa_key
+    with pytest.raises(InvalidAlgorithmError):
+        verify_token(parse_token(_token(private_key)), key, issuer=ISSUER, allowed_algorithms={"ES256"})
+
+
+def test_wrong_key_is_rejected(rsa_key):
+    _, key = rsa_key
+    other_private_key, _ = _rsa_key()
+    with pytest.raises(InvalidSignatureError):
+        verify_token(parse_token(_token(other_private_key)), key, issuer=ISSUER)
+
+
+def test_wrong_key_type_is_rejected(rsa_key):
+    _, key = rsa_key
+    ec_private_key, _ = _ec_key()
+    with pytest.raises(InvalidAlgorithmError):
+        verify_token(parse_token(_token(ec_private_key, alg="ES256")), key, issuer=ISSUER)
+
+
+def test_tampered_payload_is_rejected(rsa_key):
+    private_key, key = rsa_key
+    header, _, signature = _token(private_key).split(".")
+    forged = ".".join([header, _b64(_claims(sub="admin")), signature])
+    with pytest.raises(InvalidSignatureError):
+        verify_token(parse_token(forged), key, issuer=ISSUER)
+
+
+def test_expired(rsa_key):
+    private_key, key = rsa_key
+    token = _token(private_key, exp=int(time.time()) - 10)
+    with pytest.raises(ExpiredSignatureError):
+        verify_token(parse_token(token), key, issuer=ISSUER)
+    # leeway の範囲内なら通す
+    verify_token(parse_token(token), key, issuer=ISSUER, leeway=60)
+
+
+def test_not_before(rsa_key):
+    private_key, key = rsa_key
+    token = _token(private_key, nbf=int(time.time()) + 60)
+    with pytest.raises(ImmatureSignatureError):
+        verify_token(parse_token(token), key, issuer=ISSUER)
+    verify_token(parse_token(token), key, issuer=ISSUER, leeway=120)
+
+
+def test_non_numeric_exp_is_rejected(rsa_key):
+    private_key, key = rsa_key
+    header, _, _ = _token(private_key).split(".")
+    payload = _b64(_claims(exp="tomorrow"))
+    signing_input = f"{header}.{payload}".encode()
+    signature = key.algorithm.sign(signing_input, private_key)
+    token = f"{header}.{payload}.{base64.urlsafe_b64encode(signature).rstrip(b'=').decode()}"
+    with pytest.raises(DecodeError):
+        verify_token(parse_token(token), key, issuer=ISSUER)
+
+
+def test_wrong_issuer(rsa_key):
+    private_key, key = rsa_key
+    with pytest.raises(InvalidIssuerError):
+        verify_token(parse_token(_token(private_key, iss="https://evil.example/realms/x")), key, issuer=ISSUER)
+
+
+def test_audience(rsa_key):
+    private_key, key = rsa_key
+    token = parse_token(_token(private_key))
+    # audience を渡さなければ aud は検証しない（app.py の既定）
+    verify_token(token, key, issuer=ISSUER)
+    verify_token(token, key, issuer=ISSUER, audience="backend-api")
+    with pytest.raises(InvalidAudienceError):
+        verify_token(token, key, issuer=ISSUER, audience="other-api")
+    single = parse_token(_token(private_key, aud="backend-api"))
+    verify_token(single, key, issuer=ISSUER, audience="backend-api")
+    missing = parse_token(_token(private_key, aud=None))
+    with pytest.raises(MissingRequiredClaimError):
+        verify_token(missing, key, issuer=ISSUER, audience="backend-api")
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        {"alg": "RS256", "kid": ["rsa-1"]},
+        {"alg": "RS256", "kid": {"k": 1}},
+        {"alg": ["RS256"], "kid": "rsa-1"},
+        {"kid": "rsa-1"},
+    ],
+)
+def test_non_string_kid_or_alg_is_rejected(header):
+    token = ".".join([_b64(header), _b64(_claims()), "c2ln"])
+    with pytest.raises(DecodeError):
+        parse_token(token)
+
+
+@pytest.mark.parametrize("token", ["", "abc", "a.b", "!!.??.##", _b64({"alg": "RS256"}) + ".bm90LWpzb24.c2ln"])
+def test_malformed_token(token):
+    with pytest.raises(DecodeError):
+        parse_token(token)